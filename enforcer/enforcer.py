@@ -2,7 +2,10 @@
 
 import asyncio
 import logging
-from typing import ClassVar, Optional, Union, cast
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from time import monotonic
+from typing import Awaitable, Callable, ClassVar, Dict, List, Optional, Tuple, Union, cast
 
 import discord
 from redbot.core import Config, checks, commands
@@ -17,12 +20,142 @@ KEY_NOMEDIA = "nomedia"
 KEY_REQUIREMEDIA = "requiremedia"
 KEY_MINDISCORDAGE = "minimumdiscordage"
 KEY_MINGUILDAGE = "minimumguildage"
+KEY_REPORTALL = "reportall"
+
+# Seconds to wait for Discord to attach link embeds to a message
+EMBED_TIMEOUT = 2.0
+# Seconds to remember that a user does not accept DMs
+DM_CLOSED_TTL = 3600
+# Seconds to collect log entries before posting them, and the most embeds Discord allows per message
+LOG_FLUSH_INTERVAL = 5.0
+LOG_EMBEDS_PER_MESSAGE = 10
+# Total characters Discord allows across the embeds of one message, and how much of each enforced message to log
+LOG_CHARS_PER_MESSAGE = 6000
+LOG_DESCRIPTION_LIMIT = 1024
 
 CUSTOM_CONTROLS = {"⬅️": prev_page, "⏹️": close_menu, "➡️": next_page}
 
 log = logging.getLogger("red.rhomelab.enforcer")
 
 
+class Rule(ABC):
+    """A cheap, synchronous check compiled from a channel's config"""
+
+    reason: ClassVar[str]
+
+    @abstractmethod
+    def is_violated(self, message: discord.Message) -> bool: ...
+
+
+class AsyncRule(ABC):
+    """A check which may have to wait on Discord, so is run after every synchronous Rule.
+
+    Returns the reason for the violation, or None if the message is fine."""
+
+    @abstractmethod
+    async def violation(
+        self, message: discord.Message, check_embeds: Callable[[discord.Message], Awaitable[bool]]
+    ) -> Optional[str]: ...
+
+
+@dataclass
+class MinCharsRule(Rule):
+    minchars: int
+    reason = "Not enough characters"
+
+    def is_violated(self, message: discord.Message) -> bool:
+        return len(message.content) < self.minchars
+
+
+@dataclass
+class MaxCharsRule(Rule):
+    maxchars: int
+    reason = "Too many characters"
+
+    def is_violated(self, message: discord.Message) -> bool:
+        return len(message.content) > self.maxchars
+
+
+@dataclass
+class NoTextRule(Rule):
+    reason = "Message had no text"
+
+    def is_violated(self, message: discord.Message) -> bool:
+        return not message.content
+
+
+@dataclass
+class MinDiscordAgeRule(Rule):
+    seconds: int
+    reason = "User account not old enough"
+
+    def is_violated(self, message: discord.Message) -> bool:
+        created_at = message.author.created_at
+        return bool(created_at) and (discord.utils.utcnow() - created_at).total_seconds() < self.seconds
+
+
+@dataclass
+class MinGuildAgeRule(Rule):
+    seconds: int
+    reason = "User not in server long enough"
+
+    def is_violated(self, message: discord.Message) -> bool:
+        author = message.author
+        if not isinstance(author, discord.Member) or not author.joined_at:
+            return False
+        return (discord.utils.utcnow() - author.joined_at).total_seconds() < self.seconds
+
+
+@dataclass
+class MediaRule(AsyncRule):
+    """The media checks, which may have to wait for Discord to generate embeds"""
+
+    nomedia: bool
+    requiremedia: bool
+
+    async def violation(
+        self, message: discord.Message, check_embeds: Callable[[discord.Message], Awaitable[bool]]
+    ) -> Optional[str]:
+        # Attachments settle the question without waiting for embeds
+        has_media = bool(message.attachments) or await check_embeds(message)
+        if self.requiremedia and not has_media:
+            # They breached requiremedia attribute
+            return "Requires media attached"
+        if self.nomedia and has_media:
+            # They breached nomedia attribute
+            return "No media allowed"
+        return None
+
+
+@dataclass
+class ChannelRules:
+    """A channel's config compiled into checks, ordered cheapest first"""
+
+    rules: List[Rule]
+    async_rules: List[AsyncRule]
+    report_all: bool
+
+    @classmethod
+    def compile(cls, channel: dict) -> "ChannelRules":
+        rules: List[Rule] = []
+        if channel.get(KEY_NOTEXT):
+            rules.append(NoTextRule())
+        if channel.get(KEY_MINCHARS):
+            rules.append(MinCharsRule(channel[KEY_MINCHARS]))
+        if channel.get(KEY_MAXCHARS):
+            rules.append(MaxCharsRule(channel[KEY_MAXCHARS]))
+        if channel.get(KEY_MINDISCORDAGE):
+            rules.append(MinDiscordAgeRule(channel[KEY_MINDISCORDAGE]))
+        if channel.get(KEY_MINGUILDAGE):
+            rules.append(MinGuildAgeRule(channel[KEY_MINGUILDAGE]))
+
+        async_rules: List[AsyncRule] = []
+        if channel.get(KEY_NOMEDIA) or channel.get(KEY_REQUIREMEDIA):
+            async_rules.append(MediaRule(bool(channel.get(KEY_NOMEDIA)), bool(channel.get(KEY_REQUIREMEDIA))))
+
+        return cls(rules=rules, async_rules=async_rules, report_all=bool(channel.get(KEY_REPORTALL)))
+
+
 class EnforcerCog(commands.Cog):
     """Enforcer Cog"""
 
@@ -35,6 +168,7 @@ class EnforcerCog(commands.Cog):
         KEY_REQUIREMEDIA: {"type": "bool"},
         KEY_MINDISCORDAGE: {"type": "number"},
         KEY_MINGUILDAGE: {"type": "number"},
+        KEY_REPORTALL: {"type": "bool"},
     }
 
     def __init__(self, bot):
@@ -49,6 +183,26 @@ class EnforcerCog(commands.Cog):
 
         self.config.register_guild(**default_guild_settings, force_registration=True)
 
+        # guild ID -> channel ID -> compiled rules of each enabled channel, loaded on first use
+        self.channel_rules: Dict[int, Dict[int, ChannelRules]] = {}
+        # guild ID -> number of times its rules have been invalidated, so loads racing a change are discarded
+        self.rules_generation: Dict[int, int] = {}
+        # message ID -> future resolved when Discord attaches media embeds to the message
+        self.embed_waiters: Dict[int, asyncio.Future] = {}
+        # user ID -> monotonic time until which we assume their DMs are closed. Entries all have the
+        # same TTL, so insertion order is expiry order and expired entries can be evicted from the front.
+        self.dm_closed: Dict[int, float] = {}
+        # log channel ID -> (channel, [(embed, plain text fallback)]) waiting to be posted
+        self.pending_logs: Dict[int, Tuple[discord.abc.Messageable, List[Tuple[discord.Embed, str]]]] = {}
+        self.log_flush_tasks: Dict[int, asyncio.Task] = {}
+
+    async def cog_unload(self):
+        for task in self.log_flush_tasks.values():
+            task.cancel()
+        # Post anything still waiting rather than dropping it
+        for channel_id in list(self.pending_logs):
+            await self.flush_logs(channel_id)
+
     def _is_valid_channel(self, channel: "discord.guild.GuildChannel | None"):
         if channel is not None and not isinstance(channel, (discord.ForumChannel, discord.CategoryChannel)):
             return channel
@@ -63,17 +217,43 @@ class EnforcerCog(commands.Cog):
             return
 
         # Get channel entry from config
-        channels = list(filter(lambda c: c["id"] == message.channel.id, await self.config.guild(message.guild).channels()))
-        if not list(channels):
+        channel = (await self.get_channel_rules(message.guild)).get(message.channel.id)
+        if channel is None:
             return
 
         # Check enforcer rules for channel
-        (channel,) = channels
         should_enforce = await self.check_enforcer_rules(channel, message)
 
         if should_enforce:
             self.bot.dispatch("msg_enforce", message, should_enforce)
 
+    async def get_channel_rules(self, guild: discord.Guild) -> Dict[int, ChannelRules]:
+        """Get the compiled rules of each enabled channel in a guild, keyed by channel ID"""
+        rules = self.channel_rules.get(guild.id)
+        if rules is None:
+            generation = self.rules_generation.get(guild.id, 0)
+            channels = await self.config.guild(guild).channels()
+            rules = {channel["id"]: ChannelRules.compile(channel) for channel in channels if channel.get(KEY_ENABLED)}
+            if self.rules_generation.get(guild.id, 0) == generation:
+                # Only cache if the config was not changed while it was being read
+                self.channel_rules[guild.id] = rules
+        return rules
+
+    def invalidate_channel_rules(self, guild: discord.Guild):
+        self.channel_rules.pop(guild.id, None)
+        self.rules_generation[guild.id] = self.rules_generation.get(guild.id, 0) + 1
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        waiter = self.embed_waiters.get(payload.message_id)
+        if waiter is None or waiter.done():
+            return
+
+        # Discord attaches link embeds by editing the message
+        embeds = payload.data.get("embeds") or []
+        if any(embed.get("image") or embed.get("thumbnail") for embed in embeds):
+            waiter.set_result(True)
+
     @commands.Cog.listener()
     async def on_msg_enforce(self, message: discord.Message, reason: str):
         if (
@@ -98,24 +278,14 @@ class EnforcerCog(commands.Cog):
         if log_id:
             log_channel = message.guild.get_channel(log_id)
             if channel := self._is_valid_channel(log_channel):
-                try:
-                    await channel.send(embed=data)
-                except discord.Forbidden:
-                    await channel.send(f"**Message Enforced** - {author.id} - {author} - Reason: {reason}")
+                self.queue_log(channel, data, f"**Message Enforced** - {author.id} - {author} - Reason: {reason}")
             else:
                 log.warning(
                     f"Could not find log channel for guild {message.guild.id}, message was: **Message Enforced** "
                     f"- {author.id} - {author} - Reason: {reason}"
                 )
 
-        if not author.dm_channel:
-            await author.create_dm()
-            dm_channel = cast(discord.DMChannel, author.dm_channel)
-        else:
-            dm_channel = author.dm_channel
-        try:
-            await dm_channel.send(embed=data)
-        except discord.Forbidden:
+        if not await self.send_dm(author, data):
             # User does not allow DMs
             inform_id = await self.config.guild(message.guild).userchannel()
             if inform_id:
@@ -128,6 +298,74 @@ class EnforcerCog(commands.Cog):
                         f"- {author.id} - {author} - Reason: {reason}"
                     )
 
+    async def send_dm(self, author: Union[discord.Member, discord.User], embed: discord.Embed) -> bool:
+        """DM the user, skipping users recently found to have DMs closed. Returns whether the DM was sent."""
+        now = monotonic()
+        while self.dm_closed:
+            oldest = next(iter(self.dm_closed))
+            if self.dm_closed[oldest] > now:
+                break
+            del self.dm_closed[oldest]
+
+        if author.id in self.dm_closed:
+            return False
+
+        if not author.dm_channel:
+            await author.create_dm()
+            dm_channel = cast(discord.DMChannel, author.dm_channel)
+        else:
+            dm_channel = author.dm_channel
+        try:
+            await dm_channel.send(embed=embed)
+        except discord.Forbidden:
+            self.dm_closed[author.id] = monotonic() + DM_CLOSED_TTL
+            return False
+        return True
+
+    def queue_log(self, channel: discord.abc.Messageable, embed: discord.Embed, fallback: str):
+        """Queue a log entry, to be posted alongside any others for the same channel"""
+        channel_id = channel.id  # type: ignore
+        self.pending_logs.setdefault(channel_id, (channel, []))[1].append((embed, fallback))
+        if channel_id not in self.log_flush_tasks:
+            self.log_flush_tasks[channel_id] = self.bot.loop.create_task(self.flush_logs_later(channel_id))
+
+    async def flush_logs_later(self, channel_id: int):
+        try:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        finally:
+            del self.log_flush_tasks[channel_id]
+        await self.flush_logs(channel_id)
+
+    async def flush_logs(self, channel_id: int):
+        pending = self.pending_logs.pop(channel_id, None)
+        if pending is None:
+            return
+
+        channel, entries = pending
+        chunk: List[Tuple[discord.Embed, str]] = []
+        chunk_chars = 0
+        for embed, fallback in entries:
+            if embed.description and len(embed.description) > LOG_DESCRIPTION_LIMIT:
+                embed.description = embed.description[: LOG_DESCRIPTION_LIMIT - 1] + "…"
+            if chunk and (len(chunk) == LOG_EMBEDS_PER_MESSAGE or chunk_chars + len(embed) > LOG_CHARS_PER_MESSAGE):
+                await self.send_logs(channel, chunk)
+                chunk, chunk_chars = [], 0
+            chunk.append((embed, fallback))
+            chunk_chars += len(embed)
+        if chunk:
+            await self.send_logs(channel, chunk)
+
+    async def send_logs(self, channel: discord.abc.Messageable, chunk: List[Tuple[discord.Embed, str]]):
+        try:
+            await channel.send(embeds=[embed for embed, _ in chunk])
+            return
+        except discord.HTTPException:
+            log.warning("Failed to post enforcer logs as embeds, falling back to text", exc_info=True)
+        try:
+            await channel.send("\n".join(fallback for _, fallback in chunk))
+        except discord.HTTPException:
+            log.exception("Failed to post enforcer logs: %s", "; ".join(fallback for _, fallback in chunk))
+
     @commands.group(name="enforcer")  # type: ignore
     @commands.guild_only()
     @checks.admin()
@@ -181,6 +419,7 @@ class EnforcerCog(commands.Cog):
         - `nomedia` - Message must not have an attachment. Default false.
         - `minimumdiscordage` - Account created age in seconds. Default 0.
         - `minimumguildage` - Minimum server joined age in seconds. Default 0.
+        - `reportall` - Report every rule a message breaks, not just the first. Default false.
         """
         attribute = attribute.lower()
 
@@ -268,6 +507,7 @@ class EnforcerCog(commands.Cog):
             for _channel in channels:
                 if _channel["id"] == channel.id:
                     del _channel[attribute]
+        self.invalidate_channel_rules(channel.guild)
 
     async def _set_attribute(self, channel: discord.TextChannel, attribute, value):
         added = False
@@ -282,6 +522,7 @@ class EnforcerCog(commands.Cog):
             if added is False:
                 # Attribute does not exist for channel
                 channels.append({"id": channel.id, attribute: value})
+        self.invalidate_channel_rules(channel.guild)
 
     def is_valid_message(self, message: discord.Message) -> bool:
         """Determines whether a message is worth evaluating"""
@@ -297,64 +538,47 @@ class EnforcerCog(commands.Cog):
 
         return True
 
-    async def check_enforcer_rules(self, channel: dict, message: discord.Message) -> Union[bool, str]:
+    async def check_enforcer_rules(self, channel: ChannelRules, message: discord.Message) -> Union[bool, str]:
         """Check message against channel enforcer rules"""
-        author = message.author
-        enforcer_error = ""
-
-        if not channel.get(KEY_ENABLED):
-            # Enforcing not enabled here
-            return False
-
-        elif KEY_MINDISCORDAGE in channel and author.created_at:
-            delta = discord.utils.utcnow() - author.created_at
-            if delta.total_seconds() < channel[KEY_MINDISCORDAGE]:
-                # They breached minimum discord age
-                enforcer_error = "User account not old enough"
-
-        elif KEY_MINGUILDAGE in channel and isinstance(author, discord.Member) and author.joined_at:
-            delta = discord.utils.utcnow() - author.joined_at
-            if delta.total_seconds() < channel[KEY_MINGUILDAGE]:
-                # They breached minimum guild age
-                enforcer_error = "User not in server long enough"
-
-        elif channel.get(KEY_NOTEXT) and not message.content:
-            # They breached notext attribute
-            enforcer_error = "Message had no text"
-
-        elif (KEY_MINCHARS in channel) and (len(message.content) < channel[KEY_MINCHARS]):
-            # They breached minchars attribute
-            enforcer_error = "Not enough characters"
-
-        elif (KEY_MAXCHARS in channel) and (len(message.content) > channel[KEY_MAXCHARS]):
-            # They breached maxchars attribute
-            enforcer_error = "Too many characters"
-
-        elif channel.get(KEY_NOMEDIA) or channel.get(KEY_REQUIREMEDIA):
-            # Check the embeds
-            embeds = await self.check_embeds(message)
-            if channel.get(KEY_NOMEDIA) and (embeds or message.attachments):
-                # They breached nomedia attribute
-                enforcer_error = "No media allowed"
-            if channel.get(KEY_REQUIREMEDIA) and not (embeds or message.attachments):
-                # They breached requiremedia attribute
-                enforcer_error = "Requires media attached"
-
-        if enforcer_error:
-            return enforcer_error
+        reasons = []
+        for rule in channel.rules:
+            if rule.is_violated(message):
+                if not channel.report_all:
+                    return rule.reason
+                reasons.append(rule.reason)
+
+        for rule in channel.async_rules:
+            reason = await rule.violation(message, self.check_embeds)
+            if reason:
+                if not channel.report_all:
+                    return reason
+                reasons.append(reason)
+
+        if reasons:
+            return ", ".join(reasons)
         return False
 
     async def check_embeds(self, message: discord.Message) -> bool:
         """Waits for Embeds to be generated by Discord's servers"""
-        if not message.content:
-            # If the message has no text, there will be no embeds
+        if "http" not in message.content:
+            # If the message has no links, there will be no embeds
             return False
 
-        for _ in range(4):
-            # Fetch the message
+        if self.has_media_embeds(message):
+            # Discord had already generated the embeds
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.embed_waiters[message.id] = waiter
+        try:
+            return await asyncio.wait_for(waiter, EMBED_TIMEOUT)
+        except asyncio.TimeoutError:
+            # The edit may have been missed, so check the message once
             message = await message.channel.fetch_message(message.id)
-            if message.embeds and list(filter(lambda e: any(((e.image), (e.thumbnail))), message.embeds)):
-                # If there are any embeds with a thumbnail or image property
-                return True
-            await asyncio.sleep(0.5)
-        return False
+            return self.has_media_embeds(message)
+        finally:
+            del self.embed_waiters[message.id]
+
+    def has_media_embeds(self, message: discord.Message) -> bool:
+        """Whether the message has any embeds with a thumbnail or image property"""
+        return any(embed.image or embed.thumbnail for embed in message.embeds)
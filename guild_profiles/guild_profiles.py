@@ -1,10 +1,15 @@
+import hashlib
 import logging
+import multiprocessing
 import re
+import site
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import asdict, dataclass
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Type
 
+import aiohttp
 import discord
 from aiofiles import open as aio_open
 from redbot.core import Config, checks, commands
@@ -13,6 +18,8 @@ from redbot.core.data_manager import cog_data_path
 from redbot.core.utils.menus import menu
 from redbot.core.utils.mod import is_admin_or_superior
 
+from .images import normalise_image
+
 log = logging.getLogger("red.rhomelab.guild_profiles")
 
 
@@ -22,6 +29,8 @@ class GuildAsset:
     creator: int
     created: int
     path: Path
+    # SHA-256 of the file contents. None for assets saved before files were content-addressed.
+    hash: str | None = None
 
     @classmethod
     def from_dict(cls: Type["GuildAsset"], data: dict) -> "GuildAsset":
@@ -31,6 +40,7 @@ class GuildAsset:
             creator=int(data["creator"]),
             created=int(data["created"]),
             path=Path(data["path"]),
+            hash=data.get("hash"),
         )
 
     def to_dict(self) -> dict:
@@ -73,6 +83,8 @@ class GuildProfilesCog(commands.Cog):
     MAX_PROFILE_NAME_LENGTH = 32
     REQUIRED_ATTACHMENTS = 2
     EMBED_PAGE_LENGTH = 10
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    IMAGE_WORKERS = 2
 
     def __init__(self, bot: Red):
         self.bot = bot
@@ -82,8 +94,10 @@ class GuildProfilesCog(commands.Cog):
             "next_asset_id": 0,
             # Structure: {profile_name: {"creator": id, "created": timestamp, "icon_id": id, "banner_id": id}}
             "profiles": {},
-            # Structure: {asset_id: {"name": string, "creator": id, "created": timestamp, "path": path}}
+            # Structure: {asset_id: {"name": string, "creator": id, "created": timestamp, "path": path, "hash": sha256}}
             "assets": {},
+            # Structure: {sha256: {"path": path, "refs": number of assets using the file}}
+            "asset_files": {},
         }
 
         self.config.register_guild(**default_guild)
@@ -93,6 +107,20 @@ class GuildProfilesCog(commands.Cog):
         self.assets_path = self.data_path / "assets"
         self.assets_path.mkdir(exist_ok=True, parents=True)
 
+        # Decoding and re-encoding images is CPU bound, so it runs outside the event loop.
+        # Workers are spawned rather than forked from the bot, whose other threads may hold locks.
+        # Red imports cogs from paths outside sys.path, so add this cog's parent for the workers
+        # to import normalise_image from.
+        self.image_pool = ProcessPoolExecutor(
+            max_workers=self.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=site.addsitedir,
+            initargs=(str(Path(__file__).resolve().parent.parent),),
+        )
+
+    async def cog_unload(self):
+        self.image_pool.shutdown(wait=False, cancel_futures=True)
+
     def validate_string_safe(self, name: str) -> bool:
         """
         Validate a string to ensure it is safe for use as a profile name.
@@ -113,36 +141,72 @@ class GuildProfilesCog(commands.Cog):
             return False
         return True
 
-    async def _save_attachment(self, attachment: discord.Attachment, guild_id: int, file_name: str) -> Path:
+    async def _save_attachment(self, attachment: discord.Attachment, guild: discord.Guild) -> tuple[Path, str]:
         """
-        Save an attachment to the cog's data directory.
+        Save an attachment to the cog's data directory, named by the SHA-256 hash of its contents.
+
+        The attachment is hashed as it is downloaded. If the guild already has a file with the
+        same contents, the download is discarded and the existing file gains a reference.
+        Otherwise the image is validated and normalised to Discord's limits before being stored.
 
         Args:
             attachment: The discord attachment to save
-            guild_id: The ID of the guild
-            file_name: The name to save the file as (without extension)
+            guild: The guild the asset belongs to
 
         Returns:
-            The path to the saved file relative to the assets directory
+            The path to the saved file relative to the assets directory, and its hash
         """
         if not attachment.content_type or not attachment.content_type.startswith("image/"):
             raise ValueError("The attachment could not be identified as an image.")
 
         # Create guild directory if it doesn't exist
-        guild_path = (self.assets_path / str(guild_id)).resolve()
+        guild_path = (self.assets_path / str(guild.id)).resolve()
         guild_path.mkdir(exist_ok=True)
 
-        # Determine file extension
-        file_ext = Path(attachment.filename).suffix if "." in attachment.filename else ".png"
-
-        # Set save path
-        file_path = guild_path / f"{file_name}{file_ext}"
+        # Download to a temporary file, hashing each chunk as it arrives
+        temp_path = guild_path / f".upload-{attachment.id}"
+        normalised_stem = guild_path / f".normalised-{attachment.id}"
+        normalised_path: Path | None = None
+        hasher = hashlib.sha256()
+        try:
+            async with aiohttp.request("GET", attachment.url) as response:
+                response.raise_for_status()
+                async with aio_open(temp_path, "wb") as temp_file:
+                    async for chunk in response.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+                        hasher.update(chunk)
+                        await temp_file.write(chunk)
+            digest = hasher.hexdigest()
+
+            while True:
+                if normalised_path is None and digest not in await self.config.guild(guild).asset_files():
+                    # Normalise before taking the asset_files lock, so other asset changes aren't blocked.
+                    # Raises ValueError if the upload is not a usable image.
+                    normalised_path = Path(
+                        await self.bot.loop.run_in_executor(
+                            self.image_pool, normalise_image, str(temp_path), str(normalised_stem)
+                        )
+                    )
+
+                async with self.config.guild(guild).asset_files() as asset_files:
+                    if digest in asset_files:
+                        asset_files[digest]["refs"] += 1
+                        file_path = self.assets_path / asset_files[digest]["path"]
+                        log.debug(f"Asset upload matches existing file {file_path}")
+                        break
+                    if normalised_path is not None:
+                        file_path = guild_path / f"{digest}{normalised_path.suffix}"
+                        normalised_path.replace(file_path)
+                        asset_files[digest] = {"path": str(file_path.relative_to(self.assets_path)), "refs": 1}
+                        log.debug(f"Saved asset file to {file_path}")
+                        break
+                # The matching file was deleted since it was checked, so normalise this upload after all
+        finally:
+            temp_path.unlink(missing_ok=True)
+            if normalised_path is not None:
+                normalised_path.unlink(missing_ok=True)
 
-        # Save the file
-        await attachment.save(file_path)
-        log.debug(f"Saved asset file to {file_path}")
         # Return relative path from guild directory
-        return file_path.relative_to(self.assets_path)
+        return file_path.relative_to(self.assets_path), digest
 
     async def _get_asset(self, guild: discord.Guild, id: int, check_file_exists: bool = True) -> GuildAsset:
         """Get a GuildAsset object for a given asset ID.
@@ -175,7 +239,11 @@ class GuildProfilesCog(commands.Cog):
         log.debug(f"Retrieved asset: {asset_data['name']} for guild {guild.id}")
 
         return GuildAsset(
-            name=asset_data["name"], creator=asset_data["creator"], created=asset_data["created"], path=file_path
+            name=asset_data["name"],
+            creator=asset_data["creator"],
+            created=asset_data["created"],
+            path=file_path,
+            hash=asset_data.get("hash"),
         )
 
     async def _delete_asset(self, guild: discord.Guild, id: int, asset: GuildAsset):
@@ -191,16 +259,32 @@ class GuildProfilesCog(commands.Cog):
         """
         asset_id = str(id)
 
-        if asset.path.exists():
-            asset.path.unlink()
-        else:
-            log.warning(f"Asset file for ID {asset_id} does not exist at {asset.path}. Skipping deletion.")
-
         async with self.config.guild(guild).assets() as assets:
             if asset_id not in assets:
                 raise ValueError(f"Asset ID {asset_id} does not exist in the guild's assets.")
             del assets[asset_id]
 
+        if asset.hash is None:
+            self._delete_asset_file(asset_id, asset.path)
+            return
+
+        # Only remove the file once no other asset shares it. This is done under the lock so an
+        # upload of the same image can't record the file just before it is removed.
+        async with self.config.guild(guild).asset_files() as asset_files:
+            asset_file = asset_files.get(asset.hash)
+            if asset_file is not None:
+                asset_file["refs"] -= 1
+                if asset_file["refs"] > 0:
+                    return
+                del asset_files[asset.hash]
+            self._delete_asset_file(asset_id, asset.path)
+
+    def _delete_asset_file(self, asset_id: str, path: Path):
+        if path.exists():
+            path.unlink()
+        else:
+            log.warning(f"Asset file for ID {asset_id} does not exist at {path}. Skipping deletion.")
+
     async def _get_profile(self, guild: discord.Guild, name: str) -> GuildProfile:
         """Get a GuildProfile object for a given profile name.
 
@@ -587,7 +671,7 @@ class GuildProfilesCog(commands.Cog):
         asset_id = int(await self.config.guild(ctx.guild).next_asset_id())
 
         try:
-            file_path = await self._save_attachment(attachment, ctx.guild.id, str(asset_id))
+            file_path, file_hash = await self._save_attachment(attachment, ctx.guild)
         except Exception as e:
             log.error(f"Failed to save asset file for guild {ctx.guild.id}: {e!s}")
             return await ctx.send(f"Failed to save the asset file: {e!s}")
@@ -597,6 +681,7 @@ class GuildProfilesCog(commands.Cog):
             creator=ctx.author.id,
             created=int(discord.utils.utcnow().timestamp()),
             path=file_path,
+            hash=file_hash,
         )
 
         # Update the assets dictionary with the new asset
@@ -711,16 +796,24 @@ class GuildProfilesCog(commands.Cog):
             )
             return await ctx.send("No guild profile assets have been created yet.")
 
+        # Collect the assets in use once, rather than scanning the profiles for every asset
+        profiles = await self.config.guild(ctx.guild).profiles()
+        used_asset_ids = set()
+        for profile_name, profile_data in profiles.items():
+            profile = GuildProfile.from_dict(profile_name, profile_data)
+            used_asset_ids.update((profile.icon_id, profile.banner_id))
+
         unused_assets = []
-        for id, _ in assets.items():
+        for id, data in assets.items():
+            if int(id) in used_asset_ids:
+                continue
             try:
-                asset = await self._get_asset(ctx.guild, int(id), check_file_exists=False)
-            except ValueError as e:
+                asset = GuildAsset.from_dict(data)
+            except (KeyError, ValueError) as e:
                 log.error(f"Failed to retrieve asset {id} for guild {ctx.guild.id}: {e!s}")
                 continue
-            asset_assigned_profiles = await self._check_asset_assigned_profiles(ctx.guild, int(id))
-            if not asset_assigned_profiles:
-                unused_assets.append((int(id), asset))
+            asset.path = self.assets_path / asset.path
+            unused_assets.append((int(id), asset))
 
         if not unused_assets:
             log.debug(
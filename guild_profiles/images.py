@@ -0,0 +1,75 @@
+"""Image validation and normalisation for guild profile assets.
+
+These functions are CPU bound and are run in a process pool, away from the event loop.
+"""
+
+import shutil
+from pathlib import Path
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Discord rejects guild icons and banners larger than this
+MAX_FILE_SIZE = 10 * 1024 * 1024
+# Smallest width or height accepted for an asset
+MIN_DIMENSION = 128
+# Images are downsized so neither side exceeds this
+MAX_DIMENSION = 2048
+# Images with more pixels than this are rejected before being decoded
+MAX_PIXELS = 50_000_000
+
+
+def normalise_image(source: str, destination_stem: str) -> str:
+    """
+    Validate an uploaded image and save a copy Discord will accept as a guild icon or banner.
+
+    Static images are downsized to fit within MAX_DIMENSION and re-encoded as PNG, or as JPEG
+    if the PNG would be too large. Animated GIFs are kept as they are, as long as they fit.
+
+    Args:
+        source: Path to the uploaded file
+        destination_stem: Path to save the result to, without a file extension
+
+    Returns:
+        The path the result was saved to
+
+    Raises:
+        ValueError: If the file is not a usable image.
+    """
+    try:
+        image = Image.open(source)
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError("The attachment could not be read as an image.") from e
+
+    with image:
+        width, height = image.size
+        if width < MIN_DIMENSION or height < MIN_DIMENSION:
+            raise ValueError(f"The image must be at least {MIN_DIMENSION}x{MIN_DIMENSION} pixels.")
+        if width * height > MAX_PIXELS:
+            raise ValueError("The image has too many pixels.")
+
+        if image.format == "GIF" and getattr(image, "is_animated", False):
+            if Path(source).stat().st_size > MAX_FILE_SIZE:
+                raise ValueError(f"Animated images must be under {MAX_FILE_SIZE // (1024 * 1024)} MB.")
+            destination = f"{destination_stem}.gif"
+            shutil.copyfile(source, destination)
+            return destination
+
+        try:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+        except (OSError, Image.DecompressionBombError) as e:
+            raise ValueError("The image could not be decoded.") from e
+
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+        destination = f"{destination_stem}.png"
+        image.save(destination, format="PNG")
+        if Path(destination).stat().st_size <= MAX_FILE_SIZE:
+            return destination
+
+        # Too large as a PNG, so fall back to JPEG and lose any transparency
+        Path(destination).unlink()
+        destination = f"{destination_stem}.jpg"
+        image.convert("RGB").save(destination, format="JPEG", quality=90)
+        return destination
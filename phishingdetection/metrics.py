@@ -0,0 +1,38 @@
+from typing import Protocol, runtime_checkable
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+# Name of the prometheus_exporter cog, which serves our registry when loaded
+PROM_EXPORTER_COG = "PromExporter"
+
+
+@runtime_checkable
+class CollectorHost(Protocol):
+    """A cog which can expose additional prometheus collectors, i.e. prometheus_exporter"""
+
+    def register_collector(self, collector) -> None: ...
+
+    def unregister_collector(self, collector) -> None: ...
+
+
+class PhishingMetrics:
+    """Detection metrics, kept in a private registry so they survive exporter reloads"""
+
+    def __init__(self, prefix: str = "discord_metrics_phishing"):
+        self.registry = CollectorRegistry()
+
+        self.scans = Counter(f"{prefix}_scans", "messages scanned for phishing links", registry=self.registry)
+        self.cache_hits = Counter(
+            f"{prefix}_verdict_cache_hits", "scans answered by the verdict cache", registry=self.registry
+        )
+        self.detections = Counter(f"{prefix}_detections", "messages containing phishing links", registry=self.registry)
+        self.deletes = Counter(f"{prefix}_deletes", "phishing messages deleted", registry=self.registry)
+        self.timeouts = Counter(f"{prefix}_timeouts", "authors timed out for posting phishing links", registry=self.registry)
+        self.dropped = Counter(f"{prefix}_dropped", "messages dropped because the scan queue was full", registry=self.registry)
+        self.matcher_latency = Histogram(
+            f"{prefix}_matcher_duration_seconds",
+            "time taken to run the phishing link matcher over a message",
+            buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1),
+            registry=self.registry,
+        )
+        self.queue_size = Gauge(f"{prefix}_queue_size", "messages waiting to be scanned", registry=self.registry)
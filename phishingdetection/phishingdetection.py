@@ -1,14 +1,66 @@
 """discord red-bot phishing link detection"""
 
+import asyncio
+import logging
 import re
-from typing import Callable, List, Literal, Optional, Set, TypedDict
+from collections import OrderedDict
+from datetime import timedelta
+from time import monotonic, perf_counter
+from typing import Callable, Dict, Generic, Hashable, Iterable, List, Literal, Optional, Set, Tuple, TypedDict, TypeVar
 
 import aiohttp
 import discord
 from discord.ext import tasks
-from redbot.core import commands
+from redbot.core import Config, checks, commands
 from redbot.core.bot import Red
 
+from .metrics import PROM_EXPORTER_COG, CollectorHost, PhishingMetrics
+
+log = logging.getLogger("red.rhomelab.phishingdetection")
+
+# Maximum number of messages waiting to be scanned before new ones are dropped
+SCAN_QUEUE_SIZE = 1000
+# Number of concurrent scan workers consuming the queue
+SCAN_WORKERS = 4
+# Number of recently scanned message IDs remembered for deduplication
+SCANNED_CACHE_SIZE = 10000
+# Number of verdicts remembered, keyed by normalised content hash
+VERDICT_CACHE_SIZE = 10000
+
+# Seconds to collect detections in a channel before bulk deleting them
+DELETE_WINDOW = 1.0
+# Discord limits for bulk deletion
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = timedelta(days=14)
+
+BulkDeletable = (discord.TextChannel, discord.Thread, discord.VoiceChannel, discord.StageChannel)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """A minimal least-recently-used mapping with a fixed capacity"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
 
 def api_endpoint(endpoint: str) -> str:
     return f"https://phish.sinking.yachts/v2{endpoint}"
@@ -24,6 +76,33 @@ def generate_predicate_from_urls(urls: Set[str]) -> Callable[[str], bool]:
     return predicate
 
 
+def normalise_text(text: str) -> str:
+    """Lowercase the text and collapse all whitespace into single spaces.
+
+    Domains are case-insensitive, and the predicate expects URLs to be delimited by spaces,
+    so this both widens detection and lets repeated spam payloads share a verdict."""
+    return " ".join(text.lower().split())
+
+
+def _collect_text(content: str, embeds: Iterable[discord.Embed], attachments: Iterable[discord.Attachment]) -> List[str]:
+    parts = [content]
+    for embed in embeds:
+        parts.extend(filter(None, (embed.url, embed.title, embed.description, embed.author.url)))
+        parts.extend(field.value for field in embed.fields if field.value)
+    parts.extend(attachment.url for attachment in attachments)
+    return parts
+
+
+def get_scannable_text(message: discord.Message) -> str:
+    """Collect the content, embed URLs, attachment URLs and forwarded content of a message into one string"""
+    parts = _collect_text(message.content, message.embeds, message.attachments)
+    # Forwards only exist from discord.py 2.5, which older supported Red versions predate
+    for snapshot in getattr(message, "message_snapshots", ()):
+        parts.extend(_collect_text(snapshot.content, snapshot.embeds, snapshot.attachments))
+    # The predicate expects URLs to be delimited by spaces
+    return " ".join(part for part in parts if part)
+
+
 class DomainUpdate(TypedDict):
     type: Literal["add", "delete"]
     domains: List[str]
@@ -51,19 +130,45 @@ class PhishingDetectionCog(commands.Cog):
     predicate: Optional[Callable[[str], bool]] = None
     urls: Set[str]
     session: aiohttp.ClientSession
+    scan_queue: "asyncio.Queue[Tuple[discord.Message, str]]"
+    scanned: LRUCache[int, int]
+    verdicts: LRUCache[int, bool]
+    pending_deletes: Dict[int, Dict[int, discord.Message]]
+    timed_out: LRUCache[Tuple[int, int], float]
 
     def __init__(self, bot: Red):
         self.bot = bot
+        self.config = Config.get_conf(self, identifier=7362098415)
+        self.config.register_guild(timeout_minutes=0)
         self.session = aiohttp.ClientSession(
             headers={
                 "X-Identity": "A Red-DiscordBot instance using the phishingdetection cog from https://github.com/rhomelab/labbot-cogs"
             }
         )
+        self.scan_queue = asyncio.Queue(maxsize=SCAN_QUEUE_SIZE)
+        self.scanned = LRUCache(SCANNED_CACHE_SIZE)
+        self.verdicts = LRUCache(VERDICT_CACHE_SIZE)
+        # channel ID -> message ID -> message awaiting deletion
+        self.pending_deletes = {}
+        self.flush_tasks: Dict[int, asyncio.Task] = {}
+        # (guild ID, user ID) -> monotonic time their timeout expires
+        self.timed_out = LRUCache(SCANNED_CACHE_SIZE)
+        self.metrics = PhishingMetrics()
+        self.metrics.queue_size.set_function(self.scan_queue.qsize)
+        self.attach_metrics(self.bot.get_cog(PROM_EXPORTER_COG))
+        self.scan_workers = [self.bot.loop.create_task(self.scan_worker()) for _ in range(SCAN_WORKERS)]
         self.initialise_url_set.start()
 
     async def cog_unload(self):
         self.initialise_url_set.cancel()
         self.update_urls.cancel()
+        for worker in self.scan_workers:
+            worker.cancel()
+        for task in self.flush_tasks.values():
+            task.cancel()
+        exporter = self.bot.get_cog(PROM_EXPORTER_COG)
+        if isinstance(exporter, CollectorHost):
+            exporter.unregister_collector(self.metrics.registry)
         self.bot.loop.run_until_complete(self.session.close())
 
     @tasks.loop(hours=1.0)
@@ -75,7 +180,7 @@ class PhishingDetectionCog(commands.Cog):
             return
 
         self.urls = urls
-        self.predicate = generate_predicate_from_urls(self.urls)
+        self.set_predicate(generate_predicate_from_urls(self.urls))
 
         self.update_urls.start()
         self.initialise_url_set.cancel()  # type: ignore
@@ -99,17 +204,173 @@ class PhishingDetectionCog(commands.Cog):
                     except KeyError:
                         pass
 
-        self.predicate = generate_predicate_from_urls(self.urls)
+        self.set_predicate(generate_predicate_from_urls(self.urls))
+
+    def set_predicate(self, predicate: Callable[[str], bool]):
+        self.predicate = predicate
+        # Cached verdicts were made against the old URL set
+        self.verdicts.clear()
+
+    def attach_metrics(self, exporter: Optional[commands.Cog]):
+        """Expose our metrics through the prometheus_exporter cog, if it is loaded"""
+        if isinstance(exporter, CollectorHost):
+            exporter.register_collector(self.metrics.registry)
 
     @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
+    async def on_prom_exporter_ready(self, exporter: commands.Cog):
+        self.attach_metrics(exporter)
+
+    def enqueue_scan(self, message: discord.Message):
+        """Queue a message for scanning without blocking the calling listener"""
         if self.predicate is None:
             # It's possible that the initialisation task has not completed yet
             return
 
-        if not self.predicate(message.content):
+        text = normalise_text(get_scannable_text(message))
+        if not text:
+            return
+
+        # Skip messages whose scannable text has not changed since they were last queued
+        text_hash = hash(text)
+        if self.scanned.get(message.id) == text_hash:
+            return
+        self.scanned.set(message.id, text_hash)
+
+        try:
+            self.scan_queue.put_nowait((message, text))
+        except asyncio.QueueFull:
+            self.metrics.dropped.inc()
+            log.warning("Scan queue is full, dropping message %d in channel %d", message.id, message.channel.id)
+
+    async def scan_worker(self):
+        """Consume the scan queue until cancelled"""
+        while True:
+            message, text = await self.scan_queue.get()
+            try:
+                await self.scan_message(message, text)
+            except Exception:
+                log.exception("Failed to scan message %d", message.id)
+            finally:
+                self.scan_queue.task_done()
+
+    def is_phishing(self, text: str) -> bool:
+        """Check normalised text against the predicate, reusing the verdict for repeated payloads"""
+        if self.predicate is None:
+            return False
+
+        self.metrics.scans.inc()
+        text_hash = hash(text)
+        verdict = self.verdicts.get(text_hash)
+        if verdict is not None:
+            self.metrics.cache_hits.inc()
+            return verdict
+
+        start = perf_counter()
+        verdict = self.predicate(text)
+        self.metrics.matcher_latency.observe(perf_counter() - start)
+        self.verdicts.set(text_hash, verdict)
+        return verdict
+
+    async def scan_message(self, message: discord.Message, text: str):
+        if not self.is_phishing(text):
             # No phishing links detected
             return
 
+        self.metrics.detections.inc()
         # TODO: Maybe log this somewhere?
-        await message.delete()
+        self.queue_delete(message)
+        await self.timeout_author(message)
+
+    def queue_delete(self, message: discord.Message):
+        """Collect a detected message so detections in the same channel are deleted together"""
+        channel_id = message.channel.id
+        self.pending_deletes.setdefault(channel_id, {})[message.id] = message
+        if channel_id not in self.flush_tasks:
+            self.flush_tasks[channel_id] = self.bot.loop.create_task(self.flush_deletes(channel_id, message.channel))
+
+    async def flush_deletes(self, channel_id: int, channel: discord.abc.Messageable):
+        try:
+            await asyncio.sleep(DELETE_WINDOW)
+        finally:
+            del self.flush_tasks[channel_id]
+        messages = list(self.pending_deletes.pop(channel_id, {}).values())
+
+        # Bulk deletion is only possible in guild channels, and only for messages under two weeks old
+        if isinstance(channel, BulkDeletable):
+            cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+            bulk = [message for message in messages if message.created_at > cutoff]
+            messages = [message for message in messages if message.created_at <= cutoff]
+            for i in range(0, len(bulk), BULK_DELETE_LIMIT):
+                chunk = bulk[i : i + BULK_DELETE_LIMIT]
+                try:
+                    await channel.delete_messages(chunk, reason="Phishing link detected")
+                    self.metrics.deletes.inc(len(chunk))
+                except discord.HTTPException:
+                    log.warning("Bulk delete failed in channel %d, deleting individually", channel_id, exc_info=True)
+                    messages.extend(chunk)
+
+        for message in messages:
+            try:
+                await message.delete()
+                self.metrics.deletes.inc()
+            except discord.NotFound:
+                # Already deleted, e.g. by a moderator
+                pass
+            except discord.HTTPException:
+                log.exception("Failed to delete message %d", message.id)
+
+    async def timeout_author(self, message: discord.Message):
+        """Time out the author of a phishing message once per raid, if enabled for the guild"""
+        author = message.author
+        if message.guild is None or not isinstance(author, discord.Member):
+            return
+
+        timeout_minutes = await self.config.guild(message.guild).timeout_minutes()
+        if not timeout_minutes:
+            return
+
+        # No awaits between checking and marking the author, so concurrent workers only time them out once
+        key = (message.guild.id, author.id)
+        expiry = self.timed_out.get(key)
+        if author.is_timed_out() or (expiry is not None and expiry > monotonic()):
+            return
+        self.timed_out.set(key, monotonic() + timeout_minutes * 60)
+        try:
+            await author.timeout(timedelta(minutes=timeout_minutes), reason="Posted a phishing link")
+            self.metrics.timeouts.inc()
+        except discord.HTTPException:
+            log.warning("Failed to time out user %d in guild %d", author.id, message.guild.id, exc_info=True)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        self.enqueue_scan(message)
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        # Edits also fire when Discord resolves link embeds for a message
+        self.enqueue_scan(after)
+
+    @commands.group(name="phishingdetection")  # type: ignore
+    @commands.guild_only()
+    @checks.admin()
+    async def _phishingdetection(self, ctx: commands.Context):
+        pass
+
+    @_phishingdetection.command("timeout")
+    async def phishingdetection_timeout(self, ctx: commands.GuildContext, minutes: int):
+        """Sets how long to time out users who post phishing links.
+        Users are timed out once, however many messages they post.
+
+        Example:
+        - `[p]phishingdetection timeout <minutes>`
+        - `[p]phishingdetection timeout 0` to disable
+        """
+        if minutes < 0 or minutes > 40320:  # noqa: PLR2004
+            await ctx.send("The timeout must be between 0 and 40320 minutes (28 days).")
+            return
+
+        await self.config.guild(ctx.guild).timeout_minutes.set(minutes)
+        if minutes:
+            await ctx.send(f"Users posting phishing links will be timed out for {minutes} minutes.")
+        else:
+            await ctx.send("Users posting phishing links will no longer be timed out.")
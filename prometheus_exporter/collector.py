@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import threading
+import typing
+from dataclasses import dataclass
+from time import monotonic
+from typing import Iterable
+
+import discord
+from prometheus_client.metrics_core import GaugeMetricFamily, Metric
+from redbot.core.bot import Red
+
+from .stats import ACTIVITY_TYPES, CLIENT_TYPES, STATUSES, count_guild_stats, count_member_stats, statApi
+
+logger = logging.getLogger("red.rhomelab.prom.collector")
+
+if typing.TYPE_CHECKING:
+    from .prom_server import PrometheusMetricsServer
+
+# How long a scrape waits for the event loop to take a snapshot (seconds)
+SNAPSHOT_TIMEOUT = 10
+
+
+@dataclass
+class GuildSnapshot:
+    id: int
+    counts: dict[str, int]
+    status_counts: list[list[int]]
+    activity_counts: list[int]
+    voice_capacity: list[tuple[int, int]]
+
+    @classmethod
+    def from_guild(cls, guild: discord.Guild) -> "GuildSnapshot":
+        status_counts, activity_counts = count_member_stats(guild)
+        return cls(
+            id=guild.id,
+            counts=count_guild_stats(guild),
+            status_counts=status_counts,
+            activity_counts=activity_counts,
+            voice_capacity=[(vc.id, len(vc.members)) for vc in guild.voice_channels],
+        )
+
+
+@dataclass
+class BotSnapshot:
+    latency: float
+    guilds: list[GuildSnapshot]
+
+
+class ScrapeCollector(statApi):
+    """Computes guild metrics when prometheus scrapes the registry, rather than on a timer.
+
+    The bot state is only read on the event loop; the result is cached for poll_frequency
+    seconds so frequent scrapes do not trigger repeated recounts."""
+
+    def __init__(self, prefix: str, poll_frequency: int, bot: Red, server: "PrometheusMetricsServer"):
+        self.prefix = prefix
+        self.poll_frequency = poll_frequency
+        self.bot = bot
+        self.registry = server.registry
+
+        self.lock = threading.Lock()
+        self.cached: list[Metric] = []
+        self.cached_at = float("-inf")
+
+    def take_snapshot(self) -> BotSnapshot:
+        """Read the bot state. Must run on the event loop."""
+        logger.debug("taking snapshot of %d guilds", len(self.bot.guilds))
+        return BotSnapshot(latency=self.bot.latency, guilds=[GuildSnapshot.from_guild(guild) for guild in self.bot.guilds])
+
+    async def _take_snapshot(self) -> BotSnapshot:
+        return self.take_snapshot()
+
+    def snapshot(self) -> BotSnapshot:
+        """Take a snapshot on the event loop, from whichever thread is scraping"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self.bot.loop:
+            return self.take_snapshot()
+        future = asyncio.run_coroutine_threadsafe(self._take_snapshot(), self.bot.loop)
+        return future.result(SNAPSHOT_TIMEOUT)
+
+    def build_metrics(self, snapshot: BotSnapshot) -> list[Metric]:
+        prefix = self.prefix
+        latency = GaugeMetricFamily(f"{prefix}_bot_latency_seconds", "the latency to discord", value=snapshot.latency)
+        total_guilds = GaugeMetricFamily(
+            f"{prefix}_total_guilds_count", "the total number of guilds this bot is in", value=len(snapshot.guilds)
+        )
+        guild_stats = GaugeMetricFamily(
+            f"{prefix}_guild_stats_count", "counter stats for each guild", labels=["server_id", "stat_type"]
+        )
+        user_status = GaugeMetricFamily(
+            f"{prefix}_guild_user_status_count",
+            "count of each user status in a guild",
+            labels=["server_id", "client_type", "status"],
+        )
+        user_activity = GaugeMetricFamily(
+            f"{prefix}_guild_user_activity_count", "count of each user activity in a guild", labels=["server_id", "activity"]
+        )
+        voice_stats = GaugeMetricFamily(
+            f"{prefix}_guild_voice_stats_count",
+            "count of voice stats in a guild",
+            labels=["server_id", "channel_id", "stat_type"],
+        )
+
+        for guild in snapshot.guilds:
+            server_id = str(guild.id)
+            for stat_type, value in guild.counts.items():
+                guild_stats.add_metric([server_id, stat_type], value)
+            for client_type, counts in zip(CLIENT_TYPES, guild.status_counts):
+                for status, count in zip(STATUSES, counts):
+                    user_status.add_metric([server_id, client_type, str(status)], count)
+            for activity_type, count in zip(ACTIVITY_TYPES, guild.activity_counts):
+                user_activity.add_metric([server_id, activity_type.name], count)
+            for channel_id, capacity in guild.voice_capacity:
+                voice_stats.add_metric([server_id, str(channel_id), "capacity"], capacity)
+
+        return [latency, total_guilds, guild_stats, user_status, user_activity, voice_stats]
+
+    def collect(self) -> Iterable[Metric]:
+        with self.lock:
+            if monotonic() - self.cached_at >= self.poll_frequency:
+                try:
+                    self.cached = self.build_metrics(self.snapshot())
+                    self.cached_at = monotonic()
+                except Exception as e:
+                    # Serve the previous result rather than failing the whole scrape
+                    logger.exception(e)
+            return list(self.cached)
+
+    def start(self):
+        logger.debug("registering scrape collector")
+        self.registry.register(self)
+
+    def stop(self):
+        logger.debug("unregistering scrape collector")
+        try:
+            self.registry.unregister(self)
+        except KeyError:
+            pass
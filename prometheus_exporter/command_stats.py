@@ -0,0 +1,82 @@
+import logging
+from time import perf_counter
+
+from discord.ext.commands import CommandError, CommandInvokeError, CommandOnCooldown
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from redbot.core import commands
+from redbot.core.bot import Red
+
+logger = logging.getLogger("red.rhomelab.prom.commands")
+
+START_ATTR = "__prom_command_start"
+
+
+def command_labels(ctx: commands.Context) -> tuple[str, str]:
+    cog = ctx.cog.qualified_name if ctx.cog else "none"
+    command = ctx.command.qualified_name if ctx.command else "unknown"
+    return cog, command
+
+
+class CommandStats:
+    """Records command execution time, failures and cooldown rejections.
+
+    The start time is taken in a before_invoke hook; Red supports several of these, unlike
+    after_invoke, so completion and failure are taken from the command_completion and
+    command_error events to avoid replacing other cogs' hooks (e.g. sentry)."""
+
+    def __init__(self, prefix: str, bot: Red, registry: CollectorRegistry):
+        self.bot = bot
+
+        self.command_duration = Histogram(
+            f"{prefix}_command_duration_seconds",
+            "time taken to execute a command",
+            ["cog", "command"],
+            registry=registry,
+        )
+        self.command_failures = Counter(
+            f"{prefix}_command_failures",
+            "commands which raised an error",
+            ["cog", "command", "error"],
+            registry=registry,
+        )
+        self.command_cooldowns = Counter(
+            f"{prefix}_command_cooldowns",
+            "command invocations rejected by a cooldown",
+            ["cog", "command"],
+            registry=registry,
+        )
+
+    async def before_invoke(self, ctx: commands.Context):
+        setattr(ctx, START_ATTR, perf_counter())
+
+    def observe_duration(self, ctx: commands.Context):
+        start = getattr(ctx, START_ATTR, None)
+        if start is None:
+            # The command failed before it was invoked
+            return
+        self.command_duration.labels(*command_labels(ctx)).observe(perf_counter() - start)
+
+    async def on_command_completion(self, ctx: commands.Context):
+        self.observe_duration(ctx)
+
+    async def on_command_error(self, ctx: commands.Context, error: CommandError, unhandled_by_cog: bool = False):
+        if isinstance(error, CommandOnCooldown):
+            self.command_cooldowns.labels(*command_labels(ctx)).inc()
+            return
+
+        self.observe_duration(ctx)
+        if isinstance(error, CommandInvokeError):
+            error = error.original  # type: ignore
+        self.command_failures.labels(*command_labels(ctx), type(error).__name__).inc()
+
+    def start(self):
+        logger.debug("registering command hooks")
+        self.bot.before_invoke(self.before_invoke)
+        self.bot.add_listener(self.on_command_completion)
+        self.bot.add_listener(self.on_command_error)
+
+    def stop(self):
+        logger.debug("removing command hooks")
+        self.bot.remove_before_invoke_hook(self.before_invoke)
+        self.bot.remove_listener(self.on_command_completion)
+        self.bot.remove_listener(self.on_command_error)
@@ -0,0 +1,100 @@
+import json
+import logging
+import weakref
+from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Coroutine, Optional
+
+from prometheus_client import CollectorRegistry, Histogram
+from redbot.core import Config, commands
+from redbot.core.bot import Red
+
+logger = logging.getLogger("red.rhomelab.prom.config")
+
+INSTRUMENTED_METHODS = ("get", "set", "clear")
+
+
+def value_size(value: Any) -> Optional[int]:
+    """Approximate the stored size of a config value by its JSON encoding"""
+    try:
+        return len(json.dumps(value, separators=(",", ":")))
+    except (TypeError, ValueError):
+        return None
+
+
+class ConfigStats:
+    """Times the Config storage calls made by every loaded cog.
+
+    The storage driver behind each cog's Config has its get, set and clear methods shadowed
+    by timing wrappers on the instance; removing the wrappers restores the class methods.
+    Sizes are measured by JSON-encoding each value, which is why this is opt-in."""
+
+    def __init__(self, prefix: str, bot: Red, registry: CollectorRegistry):
+        self.bot = bot
+        self.drivers: weakref.WeakSet = weakref.WeakSet()
+
+        self.config_duration = Histogram(
+            f"{prefix}_config_duration_seconds",
+            "time taken by config storage calls",
+            ["cog", "category", "operation"],
+            buckets=(0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+            registry=registry,
+        )
+        self.config_size = Histogram(
+            f"{prefix}_config_value_bytes",
+            "size of values read from and written to config storage",
+            ["cog", "category", "operation"],
+            buckets=(64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+            registry=registry,
+        )
+
+    def wrap(self, operation: str, func: Callable[..., Coroutine[Any, Any, Any]]):
+        @wraps(func)
+        async def timed(identifier_data, *args, **kwargs):
+            labels = (identifier_data.cog_name, identifier_data.category, operation)
+            start = perf_counter()
+            try:
+                result = await func(identifier_data, *args, **kwargs)
+            finally:
+                self.config_duration.labels(*labels).observe(perf_counter() - start)
+
+            if operation != "clear":
+                size = value_size(result if operation == "get" else kwargs.get("value", args[0] if args else None))
+                if size is not None:
+                    self.config_size.labels(*labels).observe(size)
+            return result
+
+        return timed
+
+    def instrument_cog(self, cog: commands.Cog):
+        for attr in vars(cog).values():
+            if not isinstance(attr, Config):
+                continue
+            driver = attr._driver
+            if driver in self.drivers:
+                # Config instances for the same cog share a driver
+                continue
+            for operation in INSTRUMENTED_METHODS:
+                setattr(driver, operation, self.wrap(operation, getattr(driver, operation)))
+            self.drivers.add(driver)
+            logger.debug("instrumented config for %s", cog.qualified_name)
+
+    def restore_drivers(self):
+        for driver in list(self.drivers):
+            for operation in INSTRUMENTED_METHODS:
+                vars(driver).pop(operation, None)
+        self.drivers.clear()
+
+    async def on_cog_add(self, cog: commands.Cog):
+        self.instrument_cog(cog)
+
+    def start(self):
+        logger.debug("instrumenting cog configs")
+        for cog in self.bot.cogs.values():
+            self.instrument_cog(cog)
+        self.bot.add_listener(self.on_cog_add)
+
+    def stop(self):
+        logger.debug("restoring cog configs")
+        self.bot.remove_listener(self.on_cog_add)
+        self.restore_drivers()
@@ -0,0 +1,55 @@
+import logging
+from typing import Iterable, Union
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.metrics_core import CounterMetricFamily, Metric
+from redbot.core.bot import Red
+
+logger = logging.getLogger("red.rhomelab.prom.gateway")
+
+
+class GatewayStats:
+    """Counts gateway dispatches by event type.
+
+    Counts are kept in a plain dict and only turned into metrics when the registry is
+    collected, so each event costs a single dict update rather than a locked metric increment.
+    Payload bytes are only available when the bot is started with debug events enabled."""
+
+    def __init__(self, prefix: str, bot: Red, registry: CollectorRegistry):
+        self.prefix = prefix
+        self.bot = bot
+        self.registry = registry
+        self.event_counts: dict[str, int] = {}
+        self.received_bytes = 0
+
+    async def on_socket_event_type(self, event_type: str):
+        self.event_counts[event_type] = self.event_counts.get(event_type, 0) + 1
+
+    async def on_socket_raw_receive(self, msg: Union[str, bytes]):
+        self.received_bytes += len(msg)
+
+    def collect(self) -> Iterable[Metric]:
+        # dict.copy does not run any python code, so it is safe against concurrent updates from the loop
+        event_counts = dict.copy(self.event_counts)
+        events = CounterMetricFamily(f"{self.prefix}_gateway_events", "gateway events dispatched", labels=["event"])
+        for event_type, count in event_counts.items():
+            events.add_metric([event_type], count)
+        yield events
+        yield CounterMetricFamily(
+            f"{self.prefix}_gateway_received_bytes", "bytes received from the gateway", value=self.received_bytes
+        )
+
+    def start(self):
+        logger.debug("registering gateway listeners")
+        self.bot.add_listener(self.on_socket_event_type)
+        self.bot.add_listener(self.on_socket_raw_receive)
+        self.registry.register(self)
+
+    def stop(self):
+        logger.debug("removing gateway listeners")
+        self.bot.remove_listener(self.on_socket_event_type)
+        self.bot.remove_listener(self.on_socket_raw_receive)
+        try:
+            self.registry.unregister(self)
+        except KeyError:
+            pass
@@ -0,0 +1,80 @@
+import logging
+from time import perf_counter
+from typing import Any, Callable, Coroutine
+
+from prometheus_client import CollectorRegistry, Histogram
+from redbot.core import commands
+from redbot.core.bot import Red
+
+logger = logging.getLogger("red.rhomelab.prom.listeners")
+
+
+class TimedListener:
+    """Wraps a cog listener to time each call.
+
+    Compares equal to the wrapped listener, so the cog's own remove_listener calls on unload
+    still find and remove it from the bot."""
+
+    def __init__(self, func: Callable[..., Coroutine[Any, Any, Any]], histogram: Histogram):
+        self.func = func
+        self.histogram = histogram
+        self.__name__ = func.__name__
+
+    async def __call__(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return await self.func(*args, **kwargs)
+        finally:
+            self.histogram.observe(perf_counter() - start)
+
+    def __eq__(self, other) -> bool:
+        return other is self or self.func == other
+
+    def __hash__(self) -> int:
+        return hash(self.func)
+
+
+class ListenerStats:
+    """Times the event listeners of every loaded cog, labelled by cog and event.
+
+    The histogram count doubles as the number of calls per listener."""
+
+    def __init__(self, prefix: str, bot: Red, registry: CollectorRegistry):
+        self.bot = bot
+
+        self.listener_duration = Histogram(
+            f"{prefix}_listener_duration_seconds",
+            "time taken by cog event listeners",
+            ["cog", "event"],
+            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+            registry=registry,
+        )
+
+    def instrument_cog(self, cog: commands.Cog):
+        for event, method in cog.get_listeners():
+            listeners = self.bot.extra_events.get(event, [])
+            for index, listener in enumerate(listeners):
+                if listener == method and not isinstance(listener, TimedListener):
+                    histogram = self.listener_duration.labels(cog.qualified_name, event.removeprefix("on_"))
+                    listeners[index] = TimedListener(listener, histogram)
+                    logger.debug("instrumented listener %s.%s", cog.qualified_name, event)
+
+    def restore_listeners(self):
+        for listeners in self.bot.extra_events.values():
+            for index, listener in enumerate(listeners):
+                if isinstance(listener, TimedListener):
+                    listeners[index] = listener.func
+
+    async def on_cog_add(self, cog: commands.Cog):
+        self.instrument_cog(cog)
+
+    def start(self):
+        logger.debug("instrumenting cog listeners")
+        for cog in self.bot.cogs.values():
+            self.instrument_cog(cog)
+        self.bot.add_listener(self.on_cog_add)
+
+    def stop(self):
+        logger.debug("restoring cog listeners")
+        self.bot.remove_listener(self.on_cog_add)
+        self.restore_listeners()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import sys
+import threading
+import traceback
+from time import monotonic
+from typing import Optional
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from redbot.core.bot import Red
+
+logger = logging.getLogger("red.rhomelab.prom.loop")
+
+# How often the lag probe is scheduled on the event loop (seconds)
+PROBE_INTERVAL = 0.5
+# How long the loop may go without running the probe before its stack is logged (seconds)
+BLOCKING_THRESHOLD = 1.0
+
+
+class LoopMonitor:
+    """Measures event loop lag and logs the loop's stack when it is blocked.
+
+    A probe task records how late each of its sleeps wakes up. A watchdog thread checks the
+    probe's heartbeat and, if it stalls past BLOCKING_THRESHOLD, logs what the loop thread is
+    running at that moment, e.g. a synchronous file write or a long markov generation."""
+
+    def __init__(self, prefix: str, bot: Red, registry: CollectorRegistry):
+        self.bot = bot
+        self.probe_task: Optional[asyncio.Task] = None
+        self.watchdog: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat = monotonic()
+
+        self.loop_lag = Histogram(
+            f"{prefix}_event_loop_lag_seconds",
+            "how late scheduled callbacks run on the event loop",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+            registry=registry,
+        )
+        self.loop_blocked = Counter(
+            f"{prefix}_event_loop_blocked",
+            f"times the event loop was blocked for over {BLOCKING_THRESHOLD} seconds",
+            registry=registry,
+        )
+
+    async def probe(self):
+        while True:
+            start = monotonic()
+            await asyncio.sleep(PROBE_INTERVAL)
+            self.heartbeat = monotonic()
+            self.loop_lag.observe(max(self.heartbeat - start - PROBE_INTERVAL, 0))
+
+    def watch(self):
+        reported = None
+        while not self.stopping.wait(BLOCKING_THRESHOLD / 2):
+            heartbeat = self.heartbeat
+            if heartbeat == reported or monotonic() - heartbeat < PROBE_INTERVAL + BLOCKING_THRESHOLD:
+                continue
+
+            # Only report each stall once
+            reported = heartbeat
+            self.loop_blocked.inc()
+            frame = sys._current_frames().get(self.loop_thread_id)  # type: ignore
+            if frame is None:
+                continue
+            logger.warning(
+                "event loop blocked for over %.1f seconds, currently running:\n%s",
+                BLOCKING_THRESHOLD,
+                "".join(traceback.format_stack(frame)),
+            )
+
+    def start(self):
+        logger.debug("starting event loop monitor")
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = monotonic()
+        self.probe_task = self.bot.loop.create_task(self.probe())
+        self.watchdog = threading.Thread(target=self.watch, name="prom-loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        logger.debug("stopping event loop monitor")
+        if self.probe_task is not None:
+            self.probe_task.cancel()
+        self.stopping.set()
+        if self.watchdog is not None:
+            self.watchdog.join()
@@ -1,14 +1,24 @@
 import logging
 
 import discord
+from prometheus_client.registry import Collector
 from redbot.core import Config, checks, commands
 from redbot.core.bot import Red
 
-from .prom_server import PrometheusMetricsServer, promServer
-from .stats import Poller, statApi
+from .collector import ScrapeCollector
+from .command_stats import CommandStats
+from .config_stats import ConfigStats
+from .gateway_stats import GatewayStats
+from .listener_stats import ListenerStats
+from .loop_monitor import LoopMonitor
+from .prom_server import PrometheusMetricsServer, aioPromServer, promServer
+from .stats import EventPoller, Poller, statApi
 
 logger = logging.getLogger("red.rhomelab.prom")
 
+STAT_APIS: dict[str, type[statApi]] = {"poll": Poller, "event": EventPoller, "scrape": ScrapeCollector}
+SERVERS: dict[str, type[PrometheusMetricsServer]] = {"wsgi": promServer, "aiohttp": aioPromServer}
+
 
 class PromExporter(commands.Cog):
     """commands for managing the prom exporter"""
@@ -19,29 +29,67 @@ class PromExporter(commands.Cog):
         self.address = "0.0.0.0"
         self.port = 9000
         self.poll_frequency = 1
+        self.mode = "poll"
+        self.server_type = "wsgi"
+        self.listener_timing = False
+        self.config_timing = False
 
         self.config = Config.get_conf(self, identifier=19283750192891838)
 
-        default_global = {"address": "0.0.0.0", "port": 9900, "poll_interval": 1}
+        default_global = {
+            "address": "0.0.0.0",
+            "port": 9900,
+            "poll_interval": 1,
+            "mode": "poll",
+            "server": "wsgi",
+            "listener_timing": False,
+            "config_timing": False,
+        }
         self.config.register_global(**default_global)
 
         self.prom_server = None
         self.stat_api = None
+        self.command_stats = None
+        self.listener_stats = None
+        self.config_stats = None
+        self.loop_monitor = None
+        self.gateway_stats = None
+        # collectors contributed by other cogs, re-registered whenever the server is recreated
+        self.collectors: set[Collector] = set()
 
     async def init(self):
         self.address = await self.config.address()
         self.port = await self.config.port()
         # we cast the interval to integer to avoid f25e678 from being a breaking change :3
         self.poll_frequency = int(await self.config.poll_interval())
+        self.mode = await self.config.mode()
+        self.server_type = await self.config.server()
+        self.listener_timing = await self.config.listener_timing()
+        self.config_timing = await self.config.config_timing()
         self.start()
 
     @staticmethod
-    def create_server(address: str, port: int):
-        return promServer(address, port)
+    def create_server(server_type: str, address: str, port: int) -> PrometheusMetricsServer:
+        return SERVERS[server_type](address, port)
 
     @staticmethod
-    def create_stat_api(prefix: str, poll_frequency: int, bot: Red, server: PrometheusMetricsServer) -> statApi:
-        return Poller(prefix, poll_frequency, bot, server)
+    def create_stat_api(mode: str, prefix: str, poll_frequency: int, bot: Red, server: PrometheusMetricsServer) -> statApi:
+        return STAT_APIS[mode](prefix, poll_frequency, bot, server)
+
+    def register_collector(self, collector: Collector):
+        """Expose an additional collector (e.g. another cog's registry) on the metrics endpoint"""
+        if collector in self.collectors:
+            return
+        self.collectors.add(collector)
+        if self.prom_server:
+            self.prom_server.registry.register(collector)
+
+    def unregister_collector(self, collector: Collector):
+        if collector not in self.collectors:
+            return
+        self.collectors.discard(collector)
+        if self.prom_server:
+            self.prom_server.registry.unregister(collector)
 
     @commands.group()
     async def prom_export(self, ctx: commands.Context):
@@ -80,6 +128,65 @@ class PromExporter(commands.Cog):
         self.reload()
         await ctx.tick()
 
+    @checks.is_owner()
+    @prom_export.command()
+    async def set_mode(self, ctx: commands.Context, mode: str):
+        """Set how guild metrics are collected
+
+        - `poll` - recount all guild stats every poll interval
+        - `event` - update guild stats from gateway events, recounting every few minutes
+        - `scrape` - count guild stats when metrics are scraped, at most once per poll interval
+        """
+        mode = mode.lower()
+        if mode not in STAT_APIS:
+            await ctx.send(f"Mode must be one of: {', '.join(STAT_APIS)}")
+            return
+
+        logger.info(f"changing mode to {mode}")
+        self.mode = mode
+        await self.config.mode.set(mode)
+        self.reload()
+        await ctx.tick()
+
+    @checks.is_owner()
+    @prom_export.command()
+    async def set_server(self, ctx: commands.Context, server_type: str):
+        """Set the HTTP server used to serve metrics
+
+        - `wsgi` - a single-threaded server in a background thread
+        - `aiohttp` - a server on the bot's event loop, supporting concurrent and gzipped scrapes
+        """
+        server_type = server_type.lower()
+        if server_type not in SERVERS:
+            await ctx.send(f"Server must be one of: {', '.join(SERVERS)}")
+            return
+
+        logger.info(f"changing server to {server_type}")
+        self.server_type = server_type
+        await self.config.server.set(server_type)
+        self.reload()
+        await ctx.tick()
+
+    @checks.is_owner()
+    @prom_export.command()
+    async def set_listener_timing(self, ctx: commands.Context, enabled: bool):
+        """Enable or disable timing of every cog's event listeners"""
+        logger.info(f"changing listener timing to {enabled}")
+        self.listener_timing = enabled
+        await self.config.listener_timing.set(enabled)
+        self.reload()
+        await ctx.tick()
+
+    @checks.is_owner()
+    @prom_export.command()
+    async def set_config_timing(self, ctx: commands.Context, enabled: bool):
+        """Enable or disable timing of every cog's Config storage calls"""
+        logger.info(f"changing config timing to {enabled}")
+        self.config_timing = enabled
+        await self.config.config_timing.set(enabled)
+        self.reload()
+        await ctx.tick()
+
     @checks.is_owner()
     @prom_export.command(name="config")
     async def show_config(self, ctx: commands.Context):
@@ -89,21 +196,55 @@ class PromExporter(commands.Cog):
             .add_field(name="Address", value=self.address)
             .add_field(name="Port", value=self.port)
             .add_field(name="Poll Frequency", value=self.poll_frequency)
+            .add_field(name="Mode", value=self.mode)
+            .add_field(name="Server", value=self.server_type)
+            .add_field(name="Listener Timing", value=self.listener_timing)
+            .add_field(name="Config Timing", value=self.config_timing)
         )
         await ctx.send(embed=conf_embed)
 
     def start(self):
-        self.prom_server = self.create_server(self.address, self.port)
-        self.stat_api = self.create_stat_api("discord_metrics", self.poll_frequency, self.bot, self.prom_server)
+        self.prom_server = self.create_server(self.server_type, self.address, self.port)
+        self.stat_api = self.create_stat_api(self.mode, "discord_metrics", self.poll_frequency, self.bot, self.prom_server)
+        self.command_stats = CommandStats("discord_metrics", self.bot, self.prom_server.registry)
+        self.loop_monitor = LoopMonitor("discord_metrics", self.bot, self.prom_server.registry)
+        self.gateway_stats = GatewayStats("discord_metrics", self.bot, self.prom_server.registry)
+        if self.listener_timing:
+            self.listener_stats = ListenerStats("discord_metrics", self.bot, self.prom_server.registry)
+        if self.config_timing:
+            self.config_stats = ConfigStats("discord_metrics", self.bot, self.prom_server.registry)
+        for collector in self.collectors:
+            self.prom_server.registry.register(collector)
 
         self.prom_server.serve()
         self.stat_api.start()
+        self.command_stats.start()
+        self.loop_monitor.start()
+        self.gateway_stats.start()
+        if self.listener_stats:
+            self.listener_stats.start()
+        if self.config_stats:
+            self.config_stats.start()
+        # let cogs loaded before us register their collectors
+        self.bot.dispatch("prom_exporter_ready", self)
 
     def stop(self):
         if self.prom_server:
             self.prom_server.stop()
         if self.stat_api:
             self.stat_api.stop()
+        if self.command_stats:
+            self.command_stats.stop()
+        if self.loop_monitor:
+            self.loop_monitor.stop()
+        if self.gateway_stats:
+            self.gateway_stats.stop()
+        if self.listener_stats:
+            self.listener_stats.stop()
+            self.listener_stats = None
+        if self.config_stats:
+            self.config_stats.stop()
+            self.config_stats = None
 
         logger.info("stopped server process")
 
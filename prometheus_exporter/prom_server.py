@@ -1,11 +1,15 @@
+import asyncio
+import gzip
 import logging
 import socket
 import threading
 from functools import partial
-from typing import Protocol
+from typing import Optional, Protocol
 from wsgiref.simple_server import WSGIRequestHandler, make_server
 
+from aiohttp import web
 from prometheus_client import CollectorRegistry, make_wsgi_app
+from prometheus_client.exposition import choose_encoder, gzip_accepted
 
 logger = logging.getLogger("red.rhomelab.prom.server")
 
@@ -70,3 +74,66 @@ class promServer(PrometheusMetricsServer):
             self.server.server_close()
             self.server_thread.join()
             logger.debug("prom server thread joined")
+
+
+class aioPromServer(promServer):
+    """Serves prometheus metrics with aiohttp on the bot's event loop.
+
+    Scrapes are handled concurrently and the registry is serialised on the same loop
+    that mutates it, so each scrape sees a consistent set of metrics."""
+
+    # shutdown of the previous server, which must release the port before a new one binds it
+    _shutdown_task: Optional[asyncio.Task] = None
+
+    def __init__(self, addr: str, port: int):
+        super().__init__(addr, port)
+        self.serve_task: Optional[asyncio.Task] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        encoder, content_type = choose_encoder(request.headers.get("Accept", ""))
+        registry = self._registry
+        if "name[]" in request.query:
+            registry = registry.restricted_registry(request.query.getall("name[]"))
+        output = encoder(registry)
+
+        headers = {"Content-Type": content_type}
+        if gzip_accepted(request.headers.get("Accept-Encoding", "")):
+            # Compression does not touch the registry, so keep it off the event loop
+            output = await asyncio.get_running_loop().run_in_executor(None, gzip.compress, output)
+            headers["Content-Encoding"] = "gzip"
+        return web.Response(body=output, headers=headers)
+
+    async def _serve(self) -> Optional[web.AppRunner]:
+        if aioPromServer._shutdown_task is not None:
+            await asyncio.gather(aioPromServer._shutdown_task, return_exceptions=True)
+
+        app = web.Application()
+        app.router.add_get("/", self.handle_metrics)
+        app.router.add_get("/metrics", self.handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.addr, self.port).start()
+        except OSError:
+            logger.exception(f"failed to start server on {self.addr}:{self.port}")
+            await runner.cleanup()
+            return None
+        logger.debug("aiohttp site started")
+        return runner
+
+    def serve(self) -> None:
+        """Starts an aiohttp server for prometheus metrics on the running event loop."""
+        logger.info(f"starting aiohttp server on {self.addr}:{self.port}")
+        self.serve_task = asyncio.get_running_loop().create_task(self._serve())
+
+    async def _stop(self, serve_task: asyncio.Task):
+        runner = await serve_task
+        if runner is not None:
+            await runner.cleanup()
+            logger.debug("aiohttp server stopped")
+
+    def stop(self) -> None:
+        logger.debug("shutting down aiohttp prom server, server exists: %s", self.serve_task is not None)
+        if self.serve_task is not None:
+            aioPromServer._shutdown_task = asyncio.get_running_loop().create_task(self._stop(self.serve_task))
+            self.serve_task = None
@@ -1,6 +1,8 @@
 import asyncio
 import logging
 import typing
+from collections import deque
+from time import monotonic, perf_counter, time
 from typing import Optional, Protocol
 
 import discord
@@ -14,6 +16,62 @@ logger = logging.getLogger("red.rhomelab.prom.stats")
 if typing.TYPE_CHECKING:
     from .prom_server import PrometheusMetricsServer
 
+# Member stats are counted into preallocated lists indexed by enum position,
+# so a single pass over guild.members fills every status and activity counter.
+STATUSES = list(discord.Status)
+STATUS_INDEX = {status: index for index, status in enumerate(STATUSES)}
+CLIENT_TYPES = ("web", "mobile", "desktop", "total")
+ACTIVITY_TYPES = [activity for activity in discord.ActivityType if "unknown" not in activity.name]
+ACTIVITY_INDEX = {activity: index for index, activity in enumerate(ACTIVITY_TYPES)}
+
+# How often the event-driven stat api recounts everything to correct drift (seconds)
+RECONCILE_INTERVAL = 300
+
+# Time each poll may spend gathering per-guild stats (seconds). Guilds that do not fit
+# are carried over to the following polls, so large bots cannot push a poll past its interval.
+GUILD_POLL_BUDGET = 0.05
+# Initial estimate of the time taken to gather stats per guild member (seconds)
+INITIAL_MEMBER_COST = 1e-6
+
+
+def count_guild_stats(guild: discord.Guild) -> dict[str, int]:
+    animated_emojis = sum(1 for emote in guild.emojis if emote.animated)
+    return {
+        "members": len(guild.members),
+        "voice_channels": len(guild.voice_channels),
+        "text_channels": len(guild.text_channels),
+        "categories": len(guild.categories),
+        "stage_channels": len(guild.stage_channels),
+        "forums": len(guild.forums),
+        "roles": len(guild.roles),
+        "emojis": len(guild.emojis),
+        "animated_emojis": animated_emojis,
+        "static_emojis": len(guild.emojis) - animated_emojis,
+    }
+
+
+def count_member_stats(guild: discord.Guild) -> tuple[list[list[int]], list[int]]:
+    """Count member statuses per client type and member activities in a single pass.
+
+    Returns status counts indexed by [CLIENT_TYPES][STATUSES] and activity counts indexed by ACTIVITY_TYPES."""
+    status_counts = [[0] * len(STATUSES) for _ in CLIENT_TYPES]
+    web_counts, mobile_counts, desktop_counts, total_counts = status_counts
+    activity_counts = [0] * len(ACTIVITY_TYPES)
+
+    for member in guild.members:
+        web_counts[STATUS_INDEX[member.web_status]] += 1
+        mobile_counts[STATUS_INDEX[member.mobile_status]] += 1
+        desktop_counts[STATUS_INDEX[member.desktop_status]] += 1
+        total_counts[STATUS_INDEX[member.status]] += 1
+
+        activity = member.activity
+        if activity is not None:
+            activity_index = ACTIVITY_INDEX.get(activity.type)
+            if activity_index is not None:
+                activity_counts[activity_index] += 1
+
+    return status_counts, activity_counts
+
 
 class statApi(Protocol):
     def __init__(self, prefix: str, poll_frequency: int, bot: Red, server: "PrometheusMetricsServer"): ...
@@ -61,44 +119,66 @@ class Poller(statApi):
             registry=self.registry,
         )
 
+        self.guild_updated_gauge = Gauge(
+            f"{prefix}_guild_stats_updated_timestamp_seconds",
+            "when the stats for each guild were last gathered",
+            ["server_id"],
+            registry=self.registry,
+        )
+
+        self.series_gauge = Gauge(
+            f"{prefix}_exporter_series_count", "number of labelled series exported by the poller", registry=self.registry
+        )
+
+        # Label sets currently exported per gauge, and those written during the current full poll.
+        # Anything live but not written during a full poll belongs to a departed guild or deleted channel.
+        self.labelled_gauges = [
+            self.guild_stats_gauge,
+            self.guild_user_status_gauge,
+            self.guild_user_activity_gauge,
+            self.guild_voice_stats_gauge,
+            self.guild_updated_gauge,
+        ]
+        self.live_series: dict[Gauge, set[tuple[str, ...]]] = {gauge: set() for gauge in self.labelled_gauges}
+        self.cycle_series: dict[Gauge, set[tuple[str, ...]]] = {gauge: set() for gauge in self.labelled_gauges}
+
+        # Guilds still to be gathered in the current round, and a moving estimate of the cost per member
+        self.pending_guilds: deque[discord.Guild] = deque()
+        self.member_cost = INITIAL_MEMBER_COST
+
+    def labelled(self, gauge: Gauge, *labelvalues) -> Gauge:
+        """Get the child of a gauge for the given label values, tracking it for removal once stale"""
+        key = tuple(str(value) for value in labelvalues)
+        self.live_series[gauge].add(key)
+        self.cycle_series[gauge].add(key)
+        return gauge.labels(*key)
+
+    def remove_stale_series(self):
+        for gauge in self.labelled_gauges:
+            stale = self.live_series[gauge] - self.cycle_series[gauge]
+            for labelvalues in stale:
+                logger.debug("removing stale series %r %s", gauge, labelvalues)
+                gauge.remove(*labelvalues)
+            self.live_series[gauge] = self.cycle_series[gauge]
+            self.cycle_series[gauge] = set()
+
+        self.series_gauge.set(sum(len(series) for series in self.live_series.values()))
+
     @timeout
     async def gather_guild_count_stats(self, guild: discord.Guild):
         logger.debug("gathering guild count stats")
-        emoji_types = [emote.animated for emote in guild.emojis]
-        data_types = {
-            "members": len(guild.members),
-            "voice_channels": len(guild.voice_channels),
-            "text_channels": len(guild.text_channels),
-            "categories": len(guild.categories),
-            "stage_channels": len(guild.stage_channels),
-            "forums": len(guild.forums),
-            "roles": len(guild.roles),
-            "emojis": len(guild.emojis),
-            "animated_emojis": emoji_types.count(True),
-            "static_emojis": emoji_types.count(False),
-        }
+        data_types = count_guild_stats(guild)
         for data_type, data in data_types.items():
             logger.debug("setting guild stats gauge server_id:%d, stat_type:%s, data:%s", guild.id, data_type, data)
-            self.guild_stats_gauge.labels(server_id=guild.id, stat_type=data_type).set(data)
+            self.labelled(self.guild_stats_gauge, guild.id, data_type).set(data)
 
     @timeout
-    async def gather_user_status_stats(self, guild: discord.Guild):
-        logger.debug("gathering user status count")
-        data_types = {
-            "web": {value: 0 for value in discord.Status},
-            "mobile": {value: 0 for value in discord.Status},
-            "desktop": {value: 0 for value in discord.Status},
-            "total": {value: 0 for value in discord.Status},
-        }
-
-        for member in guild.members:
-            data_types["web"][member.web_status] += 1
-            data_types["mobile"][member.mobile_status] += 1
-            data_types["desktop"][member.desktop_status] += 1
-            data_types["total"][member.status] += 1
-
-        for client_type, statuses in data_types.items():
-            for status, count in statuses.items():
+    async def gather_member_stats(self, guild: discord.Guild):
+        logger.debug("gathering member status and activity stats")
+        status_counts, activity_counts = count_member_stats(guild)
+
+        for client_type, counts in zip(CLIENT_TYPES, status_counts):
+            for status, count in zip(STATUSES, counts):
                 logger.debug(
                     "setting user status gauge server_id:%d, client_type:%s, status:%s, data:%d",
                     guild.id,
@@ -106,26 +186,16 @@ class Poller(statApi):
                     status,
                     count,
                 )
-                self.guild_user_status_gauge.labels(server_id=guild.id, client_type=client_type, status=status).set(count)
+                self.labelled(self.guild_user_status_gauge, guild.id, client_type, status).set(count)
 
-    @timeout
-    async def gather_user_activity_stats(self, guild: discord.Guild):
-        logger.debug("gathering user activity stats")
-        data_types = {value.name: 0 for value in discord.ActivityType if "unknown" not in value.name}
-
-        for member in guild.members:
-            if member.activity is not None and member.activity.type.name in data_types:
-                data_types[member.activity.type.name] += 1
-                logger.debug("post user activity stats collection")
-
-        for data_type, data in data_types.items():
+        for activity_type, count in zip(ACTIVITY_TYPES, activity_counts):
             logger.debug(
                 "setting user activity gauge server_id:%d, activity:%s, data:%d",
                 guild.id,
-                data_type,
-                data,
+                activity_type.name,
+                count,
             )
-            self.guild_user_activity_gauge.labels(server_id=guild.id, activity=data_type).set(data)
+            self.labelled(self.guild_user_activity_gauge, guild.id, activity_type.name).set(count)
 
     @timeout
     async def gather_voice_stats(self, guild: discord.Guild):
@@ -143,14 +213,46 @@ class Poller(statApi):
                     data_type,
                     data,
                 )
-                self.guild_voice_stats_gauge.labels(server_id=guild.id, channel_id=vc.id, stat_type=data_type).set(data)
+                self.labelled(self.guild_voice_stats_gauge, guild.id, vc.id, data_type).set(data)
+
+    async def gather_guild_stats(self, guild: discord.Guild):
+        await self.gather_guild_count_stats(guild)
+        await self.gather_member_stats(guild)
+        await self.gather_voice_stats(guild)
 
     async def poll_per_guild_stats(self):
-        for guild in self.bot.guilds:
-            await self.gather_guild_count_stats(guild)
-            await self.gather_user_status_stats(guild)
-            await self.gather_user_activity_stats(guild)
-            await self.gather_voice_stats(guild)
+        """Gather stats for as many guilds as fit in GUILD_POLL_BUDGET, continuing the round on the next poll"""
+        if not self.pending_guilds:
+            logger.debug("starting new round of per-guild stats")
+            for series in self.cycle_series.values():
+                series.clear()
+            self.pending_guilds.extend(self.bot.guilds)
+
+        spent = 0.0
+        while self.pending_guilds:
+            guild = self.pending_guilds[0]
+            member_count = len(guild.members)
+            # Always make progress, even if a single guild exceeds the budget
+            if spent and spent + member_count * self.member_cost > GUILD_POLL_BUDGET:
+                break
+            self.pending_guilds.popleft()
+            if self.bot.get_guild(guild.id) is None:
+                # The bot left the guild during this round
+                continue
+
+            start = perf_counter()
+            await self.gather_guild_stats(guild)
+            elapsed = perf_counter() - start
+            spent += elapsed
+            if member_count:
+                self.member_cost = 0.8 * self.member_cost + 0.2 * (elapsed / member_count)
+            self.labelled(self.guild_updated_gauge, guild.id).set(time())
+
+            # Let other tasks run between guilds
+            await asyncio.sleep(0)
+
+        if not self.pending_guilds:
+            self.remove_stale_series()
 
     @timeout
     async def poll_latency(self):
@@ -185,3 +287,97 @@ class Poller(statApi):
             logger.debug("cancelling polling loop")
 
             self.poll_task.cancel()
+
+
+class EventPoller(Poller):
+    """Keeps guild gauges up to date from gateway events.
+
+    Only latency and guild totals are polled every interval; per-guild stats are
+    recounted every RECONCILE_INTERVAL to correct any drift from missed events."""
+
+    def __init__(self, prefix: str, poll_frequency: int, bot: Red, server: "PrometheusMetricsServer"):
+        super().__init__(prefix, poll_frequency, bot, server)
+        self.listeners = [
+            self.on_presence_update,
+            self.on_member_join,
+            self.on_member_remove,
+            self.on_voice_state_update,
+            self.on_guild_channel_create,
+            self.on_guild_channel_delete,
+            self.on_guild_role_create,
+            self.on_guild_role_delete,
+            self.on_guild_emojis_update,
+            self.on_guild_join,
+        ]
+
+    def count_member(self, member: discord.Member, amount: int):
+        """Add (or with a negative amount, remove) a member's statuses and activity to the gauges"""
+        statuses = (member.web_status, member.mobile_status, member.desktop_status, member.status)
+        for client_type, status in zip(CLIENT_TYPES, statuses):
+            self.labelled(self.guild_user_status_gauge, member.guild.id, client_type, status).inc(amount)
+
+        activity = member.activity
+        if activity is not None and activity.type in ACTIVITY_INDEX:
+            self.labelled(self.guild_user_activity_gauge, member.guild.id, activity.type.name).inc(amount)
+
+    async def on_presence_update(self, before: discord.Member, after: discord.Member):
+        self.count_member(before, -1)
+        self.count_member(after, 1)
+
+    async def on_member_join(self, member: discord.Member):
+        self.labelled(self.guild_stats_gauge, member.guild.id, "members").inc()
+        self.count_member(member, 1)
+
+    async def on_member_remove(self, member: discord.Member):
+        self.labelled(self.guild_stats_gauge, member.guild.id, "members").dec()
+        self.count_member(member, -1)
+
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        for channel in {before.channel, after.channel}:
+            if isinstance(channel, discord.VoiceChannel):
+                self.labelled(self.guild_voice_stats_gauge, member.guild.id, channel.id, "capacity").set(len(channel.members))
+
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        await self.gather_guild_count_stats(channel.guild)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        await self.gather_guild_count_stats(channel.guild)
+
+    async def on_guild_role_create(self, role: discord.Role):
+        await self.gather_guild_count_stats(role.guild)
+
+    async def on_guild_role_delete(self, role: discord.Role):
+        await self.gather_guild_count_stats(role.guild)
+
+    async def on_guild_emojis_update(self, guild: discord.Guild, before, after):
+        await self.gather_guild_count_stats(guild)
+
+    async def on_guild_join(self, guild: discord.Guild):
+        await self.gather_guild_stats(guild)
+
+    def start(self):
+        async def poll_loop():
+            next_reconcile = 0.0
+            while True:
+                await self.poll_latency()
+                await self.poll_total_guilds()
+                # A reconcile round may span several polls
+                if self.pending_guilds or monotonic() >= next_reconcile:
+                    if not self.pending_guilds:
+                        logger.debug("reconciling per-guild stats")
+                        next_reconcile = monotonic() + RECONCILE_INTERVAL
+                    await self.poll_per_guild_stats()
+                await asyncio.sleep(self.poll_frequency)
+
+        logger.debug("registering event listeners")
+        for listener in self.listeners:
+            self.bot.add_listener(listener)
+
+        logger.debug("creating polling loop")
+        self.poll_task = self.bot.loop.create_task(poll_loop())
+
+    def stop(self):
+        logger.debug("removing event listeners")
+        for listener in self.listeners:
+            self.bot.remove_listener(listener)
+        super().stop()
@@ -1,13 +1,105 @@
 """discord red-bot purge"""
 
 import asyncio
+import bisect
+import csv
+import heapq
+import logging
 from datetime import datetime, timedelta, timezone
+from io import BytesIO, TextIOWrapper
+from time import time
+from typing import Dict, List, Optional, Tuple, Union
 
 import discord
 from croniter import croniter
 from croniter.croniter import CroniterBadCronError
 from redbot.core import Config, checks, commands
 
+log = logging.getLogger("red.rhomelab.purge")
+
+# Number of members to check between yields to the event loop
+SCAN_YIELD_INTERVAL = 1000
+# Number of kicks in flight at once. Kicks share a rate limit bucket per guild, which
+# discord.py waits on, so this only needs to be enough to keep that bucket busy.
+KICK_CONCURRENCY = 5
+# Seconds between updates of the progress message in the log channel
+PROGRESS_INTERVAL = 5.0
+REPORT_ATTACHED = "The full list is attached."
+
+GuildMessageable = Union[discord.TextChannel, discord.VoiceChannel, discord.StageChannel, discord.Thread]
+
+
+def has_roles(member: discord.Member) -> bool:
+    """Whether the member holds any role other than @everyone"""
+    return len(member.roles) > 1
+
+
+def build_report(filename: str, users: List[discord.Member], results: Optional[Dict[int, bool]] = None) -> discord.File:
+    """Writes a CSV with a row per user, plus whether they were kicked if results are given.
+    Users missing from results were not attempted."""
+    data = BytesIO()
+    text = TextIOWrapper(data, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+
+    header = ["user_id", "username", "joined_at"]
+    if results is not None:
+        header.append("result")
+    writer.writerow(header)
+
+    for user in users:
+        row = [str(user.id), user.name, user.joined_at.isoformat() if user.joined_at else ""]
+        if results is not None:
+            result = results.get(user.id)
+            row.append("skipped" if result is None else "kicked" if result else "failed")
+        writer.writerow(row)
+
+    # Hand the bytes back without closing them along with the wrapper
+    text.flush()
+    text.detach()
+    data.seek(0)
+    return discord.File(data, filename=filename)
+
+
+def report_filename(kind: str) -> str:
+    return f"purge-{kind}-{discord.utils.utcnow():%Y%m%d-%H%M%S}.csv"
+
+
+class PurgeCandidates:
+    """Members of a guild holding no roles, ordered by when they joined"""
+
+    def __init__(self):
+        # (joined_at timestamp, member ID), kept sorted
+        self.order: List[Tuple[float, int]] = []
+        self.joined: Dict[int, float] = {}
+        self.built = asyncio.Event()
+
+    def add(self, member: discord.Member):
+        if member.id in self.joined or member.joined_at is None:
+            return
+        joined = member.joined_at.timestamp()
+        bisect.insort(self.order, (joined, member.id))
+        self.joined[member.id] = joined
+
+    def add_all(self, members: List[discord.Member]):
+        """Adds many members at once, sorting the index once rather than inserting each"""
+        for member in members:
+            if member.id in self.joined or member.joined_at is None:
+                continue
+            joined = member.joined_at.timestamp()
+            self.order.append((joined, member.id))
+            self.joined[member.id] = joined
+        self.order.sort()
+
+    def discard(self, member_id: int):
+        joined = self.joined.pop(member_id, None)
+        if joined is not None:
+            del self.order[bisect.bisect_left(self.order, (joined, member_id))]
+
+    def joined_before(self, cutoff: float) -> List[int]:
+        """IDs of members who joined at or before the cutoff timestamp"""
+        end = bisect.bisect_right(self.order, (cutoff, float("inf")))
+        return [member_id for _, member_id in self.order[:end]]
+
 
 class PurgeCog(commands.Cog):
     """Purge Cog"""
@@ -28,10 +120,22 @@ class PurgeCog(commands.Cog):
 
         self.config.register_guild(**default_guild_settings)
 
+        # guild ID -> event set to stop the purge running in that guild
+        self.purge_runs: Dict[int, asyncio.Event] = {}
+        # Min-heap of (next run timestamp, guild ID). Entries are only current while they
+        # match next_runs, so rescheduling a guild just pushes a new entry.
+        self.schedule_heap: List[Tuple[float, int]] = []
+        self.next_runs: Dict[int, float] = {}
+        self.schedule_changed = asyncio.Event()
+        # guild ID -> members without roles, kept up to date from member events once built
+        self.candidates: Dict[int, PurgeCandidates] = {}
+
         self.purge_task = self.bot.loop.create_task(self.check_purgeable_users())
 
     async def cog_unload(self):
         self.purge_task.cancel()
+        for cancelled in self.purge_runs.values():
+            cancelled.set()
 
     async def set_crontab(self, guild, crontab):
         try:
@@ -41,119 +145,295 @@ class PurgeCog(commands.Cog):
         except CroniterBadCronError:
             return False
 
+    async def schedule_guild(self, guild: discord.Guild):
+        """Works out when the guild's next scheduled purge is due, or unschedules it if disabled"""
+        guild_config = self.config.guild(guild)
+        if not await guild_config.enabled():
+            self.next_runs.pop(guild.id, None)
+        else:
+            last_run = await guild_config.lastrun() or 0
+            crontab = await guild_config.schedule()
+            next_run = croniter(crontab, last_run).get_next(float)
+            self.next_runs[guild.id] = next_run
+            heapq.heappush(self.schedule_heap, (next_run, guild.id))
+        self.schedule_changed.set()
+
     async def check_purgeable_users(self):
-        while self == self.bot.get_cog("PurgeCog"):
-            for guild in self.bot.guilds:
-                # Only run if enabled
-                enabled = await self.config.guild(guild).enabled()
-                if not enabled:
-                    continue
-
-                # Is it time to run?
-                cur_epoch = discord.utils.utcnow()
-                last_run = await self.config.guild(guild).lastrun()
-                last_run = last_run or 0
-                crontab = await self.config.guild(guild).schedule()
-                cron_check = croniter(crontab, last_run)
-                next_execution_date = cron_check.get_next(datetime)
-
-                if next_execution_date > cur_epoch:
-                    # It's not scheduled to run yet
-                    continue
-
-                # Set the last run
-                await self.config.guild(guild).lastrun.set(cur_epoch.timestamp())
-
-                # Only run if kick_members permission is given
-                if not guild.me.guild_permissions.kick_members:
-                    continue
-
-                channel = await self.config.guild(guild).logchannel()
-                output = guild.get_channel(channel)
-                if output is None:
-                    # The log channel no longer exists
-                    continue
-
-                data = await self._purge_users(guild, "Scheduled")
-
-                if not data:
-                    # No users purged
-                    continue
+        await self.bot.wait_until_red_ready()
+        for guild in self.bot.guilds:
+            await self.schedule_guild(guild)
+
+        while True:
+            self.schedule_changed.clear()
 
+            # Drop entries for guilds that were rescheduled or disabled
+            while self.schedule_heap and self.next_runs.get(self.schedule_heap[0][1]) != self.schedule_heap[0][0]:
+                heapq.heappop(self.schedule_heap)
+
+            if not self.schedule_heap:
+                await self.schedule_changed.wait()
+                continue
+
+            next_run, guild_id = self.schedule_heap[0]
+            delay = next_run - time()
+            if delay > 0:
+                # Sleep until the next run is due, waking early if the schedule changes
                 try:
-                    await output.send(embed=data)
-                except discord.Forbidden:
-                    await output.send("I need the `Embed links` permission " + "to send a purge board.")
+                    await asyncio.wait_for(self.schedule_changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
 
-            await asyncio.sleep(60)
+            heapq.heappop(self.schedule_heap)
+            del self.next_runs[guild_id]
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            try:
+                await self.run_scheduled_purge(guild)
+            except Exception:
+                # Keep the scheduler running for other guilds
+                log.exception("Scheduled purge failed in guild %d", guild_id)
+
+    async def run_scheduled_purge(self, guild: discord.Guild):
+        # Set the last run and schedule the next one
+        await self.config.guild(guild).lastrun.set(discord.utils.utcnow().timestamp())
+        await self.schedule_guild(guild)
+
+        # Only run if kick_members permission is given
+        if not guild.me.guild_permissions.kick_members:
+            return
 
-    async def _purge_users(self, guild: discord.Guild, title: str):
-        users = await self.get_purgeable_users(guild)
+        channel = await self.config.guild(guild).logchannel()
+        output = guild.get_channel(channel)
+        if not isinstance(output, discord.abc.Messageable):
+            # The log channel no longer exists
+            return
 
-        if len(users) == 0:
+        result = await self._purge_users(guild, "Scheduled")
+
+        if not result:
+            # No users purged
+            return
+
+        data, report = result
+        await self._send_board(output, data, report, "a purge board")
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        await self.schedule_guild(guild)
+
+    async def _purge_users(self, guild: discord.Guild, title: str):
+        if guild.id in self.purge_runs:
+            # Another purge is already running in this guild
             return None
 
-        users_kicked = ""
+        # Claim the guild before any await, so a concurrent purge can't also start
+        cancelled = asyncio.Event()
+        self.purge_runs[guild.id] = cancelled
+        try:
+            users = await self.get_purgeable_users(guild)
+
+            if len(users) == 0:
+                return None
+
+            results = await self._kick_users(guild, users, title, cancelled)
+        finally:
+            if self.purge_runs.get(guild.id) is cancelled:
+                del self.purge_runs[guild.id]
 
-        for user in users:
-            result = await self._purge_user(user)
-            if not result:
-                pass
-            new_list = users_kicked + "\n" + await self._get_safe_username(user)
-            if len(new_list) > 2048:  # noqa: PLR2004
-                break
-            users_kicked = new_list
+        kicked = sum(results.values())
+        failed = len(results) - kicked
+        skipped = len(users) - len(results)
 
         data = discord.Embed(colour=discord.Colour.orange(), timestamp=discord.utils.utcnow())
-        data.title = f"{title} Purge - Purged {len(users)}"
-        data.description = users_kicked
+        data.title = f"{title} Purge - Purged {kicked}"
+        if cancelled.is_set():
+            data.title += f" of {len(users)} (Cancelled)"
+        summary = [f"Kicked {kicked} of {len(users)} users."]
+        if failed:
+            summary.append(f"Failed to kick {failed} users.")
+        if skipped:
+            summary.append(f"Skipped {skipped} users.")
+        summary.append(REPORT_ATTACHED)
+        data.description = "\n".join(summary)
+
+        report = build_report(report_filename(title.lower()), users, results)
+        return data, report
+
+    async def _kick_users(
+        self, guild: discord.Guild, users: List[discord.Member], title: str, cancelled: asyncio.Event
+    ) -> Dict[int, bool]:
+        """Kicks users with a pool of workers, reporting progress to the log channel.
+        Stops early if `cancelled` is set. Returns whether each attempted user was kicked, by ID."""
+        results: Dict[int, bool] = {}
+        pending = iter(users)
+        kicked = 0
+
+        async def worker():
+            nonlocal kicked
+            for user in pending:
+                if cancelled.is_set():
+                    return
+                results[user.id] = await self._purge_user(user)
+                kicked += results[user.id]
+
+        progress = await self._send_progress(guild, f"{title} Purge - Kicking {len(users)} users...")
+        workers = [asyncio.create_task(worker()) for _ in range(KICK_CONCURRENCY)]
+        try:
+            while not all(task.done() for task in workers):
+                await asyncio.wait(workers, timeout=PROGRESS_INTERVAL)
+                if progress is not None:
+                    await self._edit_progress(progress, f"{title} Purge - Kicked {kicked}, {len(results)}/{len(users)} done")
+        finally:
+            for task in workers:
+                task.cancel()
+            # Update the count once per run rather than after every kick
+            count = await self.config.guild(guild).count()
+            await self.config.guild(guild).count.set(count + kicked)
+
+        if progress is not None:
+            status = "Cancelled" if cancelled.is_set() else "Finished"
+            await self._edit_progress(progress, f"{title} Purge - {status}, kicked {kicked} of {len(users)}")
+        return results
+
+    async def _send_board(self, channel: GuildMessageable, data: discord.Embed, report: Optional[discord.File], board: str):
+        """Sends a purge board with its report, or without the report if it can't be uploaded"""
+        permissions = channel.permissions_for(channel.guild.me)
+        if not permissions.embed_links:
+            await channel.send(f"I need the `Embed links` permission to send {board}.")
+            return
 
-        return data
+        if report is not None:
+            if not permissions.attach_files:
+                problem = "I need the `Attach files` permission to attach the full list."
+            else:
+                try:
+                    await channel.send(embed=data, file=report)
+                    return
+                except discord.HTTPException as e:
+                    if e.status == 413:  # noqa: PLR2004
+                        problem = "The full list was too large to upload."
+                    else:
+                        problem = f"The full list could not be uploaded: {e.text or e.status}"
+            data.description = (data.description or "").replace(REPORT_ATTACHED, problem)
+
+        await channel.send(embed=data)
+
+    async def _send_progress(self, guild: discord.Guild, content: str) -> Optional[discord.Message]:
+        channel = guild.get_channel(await self.config.guild(guild).logchannel())
+        if not isinstance(channel, discord.TextChannel):
+            return None
+        try:
+            return await channel.send(content)
+        except discord.HTTPException:
+            return None
 
-    async def _get_safe_username(self, user: discord.Member):
-        replaced_name = user.name.replace("`", "")
-        return f"{replaced_name}#{user.discriminator} ({user.id})"
+    async def _edit_progress(self, message: discord.Message, content: str):
+        try:
+            await message.edit(content=content)
+        except discord.HTTPException:
+            pass
 
     async def _purge_user(self, user: discord.Member):
         try:
-            # Kick the user from the server and log it
+            # Kick the user from the server
             await user.kick()
-
-            count = await self.config.guild(user.guild).count()
-            count += 1
-            await self.config.guild(user.guild).count.set(count)
-
             return True
         except (discord.HTTPException, discord.Forbidden):
             return False
 
+    async def get_candidates(self, guild: discord.Guild) -> PurgeCandidates:
+        """Gets the guild's candidate index, building it on first use"""
+        while True:
+            candidates = self.candidates.get(guild.id)
+            if candidates is None:
+                return await self._build_candidates(guild)
+
+            await candidates.built.wait()
+            if self.candidates.get(guild.id) is candidates:
+                return candidates
+            # The build failed or the index was dropped while building, so try again
+
+    async def _build_candidates(self, guild: discord.Guild) -> PurgeCandidates:
+        # Store the index first so member events during the build are applied to it
+        candidates = self.candidates[guild.id] = PurgeCandidates()
+        try:
+            members = []
+            for index, member in enumerate(guild.members):
+                if index % SCAN_YIELD_INTERVAL == 0:
+                    # Let other tasks run while indexing large guilds
+                    await asyncio.sleep(0)
+                if not has_roles(member):
+                    members.append(member)
+            candidates.add_all(members)
+        except BaseException:
+            if self.candidates.get(guild.id) is candidates:
+                del self.candidates[guild.id]
+            raise
+        finally:
+            candidates.built.set()
+        return candidates
+
     async def get_purgeable_users(self, guild):
         """
         Gets users to purge.
         In addition, performs checks for excluded users.
         """
+        guild_config = self.config.guild(guild)
+        timelimit = await guild_config.minage()
+        excluded_users = set(await guild_config.excludedusers())
+        cutoff_date = discord.utils.utcnow() - timedelta(days=timelimit)
+
+        candidates = await self.get_candidates(guild)
         members = []
-        for member in guild.members:
-            # If user has a role other than @everyone, they're safe
-            roles = [role for role in member.roles if guild.default_role != role]
-            if len(roles) > 0:
+        # Only users with no roles who are older than the minimum age are indexed here
+        for member_id in candidates.joined_before(cutoff_date.timestamp()):
+            # If user is excluded from the purge, they're safe
+            if member_id in excluded_users:
                 continue
 
-            # If user is not older than the minimum age, they're safe
-            timelimit = await self.config.guild(guild).minage()
-            cutoff_date = discord.utils.utcnow() - timedelta(days=timelimit)
-            if member.joined_at > cutoff_date:
+            member = guild.get_member(member_id)
+            if member is None or has_roles(member):
+                # Changed while the index was being built
+                candidates.discard(member_id)
                 continue
 
-            async with self.config.guild(guild).excludedusers() as excluded_users:
-                # If user is excluded from the purge, they're safe
-                if member and member.id in excluded_users:
-                    continue
-
             members.append(member)
 
         return members
 
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        candidates = self.candidates.get(member.guild.id)
+        if candidates is not None and not has_roles(member):
+            candidates.add(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        candidates = self.candidates.get(after.guild.id)
+        if candidates is None or before.roles == after.roles:
+            return
+        if has_roles(after):
+            candidates.discard(after.id)
+        else:
+            candidates.add(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        candidates = self.candidates.get(member.guild.id)
+        if candidates is not None:
+            candidates.discard(member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        # Members whose only role was deleted don't get an update event, so rebuild on next use
+        self.candidates.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.candidates.pop(guild.id, None)
+
     @commands.group(name="purge")  # type: ignore
     @commands.guild_only()
     @checks.mod()
@@ -179,16 +459,34 @@ class PurgeCog(commands.Cog):
         Example:
         - `[p]purge execute`
         """
-        data = await self._purge_users(ctx.guild, "Manual")
+        if ctx.guild.id in self.purge_runs:
+            await ctx.send("A purge is already running.")
+            return
+
+        result = await self._purge_users(ctx.guild, "Manual")
 
-        if data is None:
+        if result is None:
             await ctx.send("No users to purge.")
             return
 
-        try:
-            await ctx.send(embed=data)
-        except discord.Forbidden:
-            await ctx.send("I need the `Embed links` permission to send " + "a purge board.")
+        data, report = result
+        await self._send_board(ctx.channel, data, report, "a purge board")
+
+    @_purge.command("cancel")
+    async def purge_cancel(self, ctx: commands.GuildContext):
+        """Stops a running purge.
+        Users already kicked will stay kicked.
+
+        Example:
+        - `[p]purge cancel`
+        """
+        cancelled = self.purge_runs.get(ctx.guild.id)
+        if cancelled is None:
+            await ctx.send("No purge is running.")
+            return
+
+        cancelled.set()
+        await ctx.send("Cancelling the purge.")
 
     @_purge.command("simulate")
     async def purge_simulate(self, ctx: commands.GuildContext):
@@ -202,18 +500,13 @@ class PurgeCog(commands.Cog):
 
         data = discord.Embed(colour=(await ctx.embed_colour()))
         data.title = f"Purge Simulation - Found {len(users)}"
-        data.description = ""
 
-        for user in users:
-            new_desc = data.description + "\n" + await self._get_safe_username(user)
-            if len(new_desc) > 2048:  # noqa: PLR2004
-                break
-            data.description = new_desc
+        report = None
+        if users:
+            data.description = f"Would kick {len(users)} users. {REPORT_ATTACHED}"
+            report = build_report(report_filename("simulation"), users)
 
-        try:
-            await ctx.send(embed=data)
-        except discord.Forbidden:
-            await ctx.send("I need the `Embed links` permission to " + "send a purge simulation board.")
+        await self._send_board(ctx.channel, data, report, "a purge simulation board")
 
     @_purge.command("exclude")
     async def purge_exclude_user(self, ctx: commands.GuildContext, user: discord.Member):
@@ -283,6 +576,7 @@ class PurgeCog(commands.Cog):
         if not new_shedule:
             await ctx.send("The schedule given was invalid.")
         else:
+            await self.schedule_guild(ctx.guild)
             await ctx.send(f"Set the schedule to `{new_shedule}`.")
 
     @_purge.command("enable")
@@ -293,6 +587,7 @@ class PurgeCog(commands.Cog):
         - `[p]purge enable`
         """
         await self.config.guild(ctx.guild).enabled.set(True)
+        await self.schedule_guild(ctx.guild)
         await ctx.send("Enabled the purge task.")
 
     @_purge.command("disable")
@@ -303,6 +598,7 @@ class PurgeCog(commands.Cog):
         - `[p]purge disable`
         """
         await self.config.guild(ctx.guild).enabled.set(False)
+        await self.schedule_guild(ctx.guild)
         await ctx.send("Disabled the purge task.")
 
     @_purge.command("status")
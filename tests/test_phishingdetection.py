@@ -1,6 +1,8 @@
+from types import SimpleNamespace
 from typing import Any, AsyncGenerator, List, Set
 
 import aiohttp
+import discord
 import pytest
 
 from phishingdetection import phishingdetection
@@ -44,3 +46,20 @@ async def test_no_false_match(urls: Set[str], legitimate_urls: Set[str]):
     for url in legitimate_urls:
         for mutation in mutate_url(url):
             assert predicate(mutation) is False
+
+
+def test_scannable_text_includes_embeds_and_forwards():
+    embed = discord.Embed(title="Free nitro", url="https://embed.example", description="claim now")
+    snapshot = SimpleNamespace(content="forwarded.example", embeds=[], attachments=[])
+    message = SimpleNamespace(content="hello", embeds=[embed], attachments=[], message_snapshots=[snapshot])
+    text = phishingdetection.get_scannable_text(message)  # type: ignore
+    predicate = phishingdetection.generate_predicate_from_urls({"embed.example", "forwarded.example"})
+    assert "https://embed.example" in text
+    assert "forwarded.example" in text
+    assert predicate(text) is True
+
+
+def test_normalised_text_matches_case_and_newlines():
+    predicate = phishingdetection.generate_predicate_from_urls({"scam.example"})
+    assert predicate("look\nHTTPS://SCAM.EXAMPLE/gift") is False
+    assert predicate(phishingdetection.normalise_text("look\nHTTPS://SCAM.EXAMPLE/gift")) is True